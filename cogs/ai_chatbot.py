@@ -4,6 +4,7 @@ from discord.ext import commands
 from discord import app_commands
 from groq import Groq
 import os
+from typing import Iterable
 from utils.checks import is_owner
 
 class AIChatbot(commands.Cog):
@@ -59,7 +60,7 @@ class AIChatbot(commands.Cog):
             # --- Fetch User Context ---
             orders = await self.bot.load_json('orders') # Using bot's load_json
             users = await self.bot.load_json('users') # Using bot's load_json
-            user_points = users.get(str(message.author.id), {}).get('points', 0)
+            user_points = users.get(message.author.id, {}).get('points', 0)
             
             user_orders_list = []
             # Filter orders for the current user and get relevant info
@@ -168,12 +169,12 @@ class AIChatbot(commands.Cog):
             print(f"AI Support Suggestion Error: {e}")
             return "Thank you for the details. Please wait while a staff member reviews your case, as the AI assistant encountered an issue generating a suggestion."
 
-    async def generate_summary(self, history: list[discord.Message]):
+    async def generate_summary(self, history: Iterable[discord.Message]):
         """Generates a summary of a ticket conversation for archival."""
         if not self.client:
             return "Summary could not be generated (AI is offline)."
             
-        # Prepare messages in chronological order (already reversed in close_ticket_action)
+        # Prepare messages in chronological order (close_ticket_action passes them oldest first)
         formatted_history = "\n".join([f"{msg.author.display_name} ({msg.author.id}): {msg.content}" for msg in history])
         
         system_prompt = "You are a helpful assistant. Summarize the following Discord ticket conversation into a single, concise paragraph for archival purposes. Focus on the initial problem, the steps taken, and the final resolution. If a resolution is not clear, state that the issue is ongoing or unresolved. Keep it under 200 words."
@@ -34,8 +34,7 @@ class RedeemSelect(discord.ui.Select):
         reward_info = next((r for r in rewards_config if r['points'] == selected_points), None)
         
         users = await self.bot.load_json('users') # Using bot's load_json
-        user_id_str = str(interaction.user.id)
-        user_data = users.get(user_id_str, {})
+        user_data = users.get(interaction.user.id, {})
         user_points = user_data.get('points', 0)
 
         if not reward_info:
@@ -48,7 +47,7 @@ class RedeemSelect(discord.ui.Select):
 
         # Deduct points
         user_data['points'] -= reward_info['points']
-        users[user_id_str] = user_data # Update the user data in the main 'users' dict
+        users[interaction.user.id] = user_data # Update the user data in the main 'users' dict
         await self.bot.save_json('users', users) # Using bot's save_json
 
         # Generate and save discount code
@@ -58,7 +57,7 @@ class RedeemSelect(discord.ui.Select):
             "type": "redeem", 
             "discount_inr": reward_info['discount_inr'],
             "used": False,
-            "generated_by": user_id_str # Track who generated it
+            "generated_by": str(interaction.user.id) # Track who generated it
         }
         await self.bot.save_json('discounts', discounts) # Using bot's save_json
 
@@ -67,7 +66,7 @@ class RedeemSelect(discord.ui.Select):
             embed = discord.Embed(
                 title="✨ Reward Redeemed!",
                 description=f"You have successfully redeemed **{reward_info['points']} points** for a **₹{reward_info['discount_inr']:.2f}** discount.",
-                color=int(self.bot.config['success_color'], 16)
+                color=self.bot.success_color_int
             )
             embed.add_field(name="Your One-Time Discount Code", value=f"`{code}`")
             embed.set_footer(text="Use the 'Apply Discount' button in your shopping cart to use this code.")
@@ -157,12 +156,12 @@ class LoyaltyProgram(commands.Cog):
     async def mypoints(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         users = await self.bot.load_json('users') # Using bot's load_json
-        points = users.get(str(interaction.user.id), {'points': 0})['points']
+        points = users.get(interaction.user.id, {'points': 0})['points']
         
         embed = discord.Embed(
             title="✨ Your Infinity Points",
             description=f"You currently have **{points}** points.",
-            color=int(self.bot.config['embed_color'], 16)
+            color=self.bot.embed_color_int
         )
         await interaction.followup.send(embed=embed, ephemeral=True)
 
@@ -170,7 +169,7 @@ class LoyaltyProgram(commands.Cog):
     async def redeem(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         users = await self.bot.load_json('users') # Using bot's load_json
-        user_points = users.get(str(interaction.user.id), {'points': 0})['points']
+        user_points = users.get(interaction.user.id, {'points': 0})['points']
         
         # Access rewards configuration correctly
         all_rewards = self.bot.config.get('loyalty_program', {}).get('rewards', [])
@@ -183,7 +182,7 @@ class LoyaltyProgram(commands.Cog):
             title="🎁 Point Redemption Store",
             description=f"You have **{user_points}** points to spend.\n\n"
                         "Select a reward from the dropdown below to redeem your points.",
-            color=int(self.bot.config['embed_color'], 16)
+            color=self.bot.embed_color_int
         )
         view = RedeemView(self.bot, affordable_rewards)
         await interaction.followup.send(embed=embed, view=view, ephemeral=True)
@@ -206,13 +205,13 @@ class LoyaltyProgram(commands.Cog):
 
         embed = discord.Embed(
             title="🏆 Infinity Points Leaderboard",
-            color=int(self.bot.config['embed_color'], 16)
+            color=self.bot.embed_color_int
         )
 
         leaderboard_lines = []
         for i, (user_id, data) in enumerate(sorted_users[:10]): # Show top 10
             try:
-                user = await self.bot.fetch_user(int(user_id))
+                user = await self.bot.fetch_user(user_id)
                 rank_emoji = {0: "🥇", 1: "🥈", 2: "🥉"}.get(i, f"**{i+1}.**")
                 leaderboard_lines.append(f"{rank_emoji} {user.mention} - `{data['points']}` points")
             except discord.NotFound:
@@ -235,13 +234,11 @@ class LoyaltyProgram(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         
         users = await self.bot.load_json('users') # Using bot's load_json
-        user_id_str = str(user.id)
-        
-        if user_id_str not in users:
-            users[user_id_str] = {'points': 0}
+        if user.id not in users:
+            users[user.id] = {'points': 0}
             
-        users[user_id_str]['points'] = max(0, users[user_id_str]['points'] + amount) # Ensure points don't go below zero
-        new_balance = users[user_id_str]['points']
+        users[user.id]['points'] = max(0, users[user.id]['points'] + amount) # Ensure points don't go below zero
+        new_balance = users[user.id]['points']
         
         await self.bot.save_json('users', users) # Using bot's save_json
 
@@ -265,7 +262,7 @@ class LoyaltyProgram(commands.Cog):
             embed = discord.Embed(
                 title="✨ Your Points Have Been Updated",
                 description="An admin has adjusted your Infinity Points balance.",
-                color=int(self.bot.config['embed_color'], 16)
+                color=self.bot.embed_color_int
             )
             embed.add_field(name="Amount", value=f"`{amount:+}` points") # Shows + or -
             embed.add_field(name="New Balance", value=f"`{new_balance}` points")
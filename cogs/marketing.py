@@ -176,7 +176,7 @@ class FlashSaleView(discord.ui.View):
                 title="⚡ Your Flash Sale Order!",
                 description=f"You've successfully claimed the flash sale for **{self.product_name}** at an incredible **₹{self.sale_price:.2f}**!\n"
                             f"Your new Order ID is `#{order_id}`.",
-                color=int(self.bot.config['success_color'], 16),
+                color=self.bot.success_color_int,
                 timestamp=datetime.datetime.now(datetime.timezone.utc)
             )
             embed.add_field(
@@ -248,7 +248,7 @@ class Marketing(commands.Cog):
         embed = discord.Embed(
             title="🤝 Your Personal Referral Code",
             description=f"Share this unique code with new customers! When they use it during their first purchase, they receive a discount, and you earn a reward.",
-            color=int(self.bot.config['embed_color'], 16),
+            color=self.bot.embed_color_int,
             timestamp=datetime.datetime.now(datetime.timezone.utc)
         )
         embed.add_field(name="Your Code", value=f"`{code}`", inline=False)
@@ -488,7 +488,7 @@ class Marketing(commands.Cog):
                         if isinstance(channel, discord.TextChannel): # Ensure it's a text channel before sending
                             embed = discord.Embed(
                                 description=message_content, 
-                                color=int(self.bot.config['embed_color'], 16),
+                                color=self.bot.embed_color_int,
                                 timestamp=datetime.datetime.now(datetime.timezone.utc) # Add timestamp to embed
                             )
                             embed.set_footer(text="Scheduled Announcement")
@@ -72,7 +72,7 @@ class ManualOrderModal(discord.ui.Modal, title="Create Manual Order"):
         if warnings:
             response_msg += "\n\n**Warnings:**\n" + "\n".join(warnings)
             
-        embed = discord.Embed(title="✅ Manual Order Created", description=response_msg, color=int(self.bot.config['success_color'], 16))
+        embed = discord.Embed(title="✅ Manual Order Created", description=response_msg, color=self.bot.success_color_int)
         await interaction.followup.send(embed=embed, ephemeral=True)
 
 class OrderProcessing(commands.Cog):
@@ -105,6 +105,8 @@ class OrderProcessing(commands.Cog):
         orders[order_id]['status'] = "Payment Received"
         orders[order_id]['payment_method'] = method.strip()
         await self.bot.save_json('orders', orders) # Using bot's save_json
+        if (payment_cog := self.bot.get_cog("PaymentGateway")):
+            payment_cog.release_payment_view(order_id)
         
         await interaction.followup.send(f"✅ Payment for order `#{order_id}` confirmed with method `{method}`. Status updated to 'Payment Received'.", ephemeral=True)
         
@@ -158,16 +160,16 @@ class OrderProcessing(commands.Cog):
         await self.bot.save_json('products', products_db) # Using bot's save_json
 
         users = await self.bot.load_json('users') # Using bot's load_json
-        user_id_str = str(order['user_id'])
-        if user_id_str not in users:
-            users[user_id_str] = {'points': 0}
+        user_id = order['user_id']
+        if user_id not in users:
+            users[user_id] = {'points': 0}
         
         # Ensure loyalty_program config exists and has points_per_order
         loyalty_config = self.bot.config.get('loyalty_program', {})
         points_to_add = loyalty_config.get('points_per_order', 1) # Default to 1 if not set
         
-        users[user_id_str]['points'] += points_to_add
-        new_balance = users[user_id_str]['points']
+        users[user_id]['points'] += points_to_add
+        new_balance = users[user_id]['points']
         await self.bot.save_json('users', users) # Using bot's save_json
 
         try:
@@ -232,7 +234,7 @@ class OrderProcessing(commands.Cog):
                     f"• **Earned:** `+{points_to_add} Point`\n"
                     f"• **Total Points:** `{new_balance:02d}`"
                 )
-                log_embed = discord.Embed(description=description, color=int(self.bot.config['success_color'], 16))
+                log_embed = discord.Embed(description=description, color=self.bot.success_color_int)
                 log_embed.set_author(name="💠 Points Logged", icon_url=interaction.user.display_avatar.url)
                 if customer:
                     log_embed.set_thumbnail(url=customer.display_avatar.url)
@@ -245,7 +247,7 @@ class OrderProcessing(commands.Cog):
             target_user_id = order.get('gift_recipient_id') or order['user_id']
             target_user = await self.bot.fetch_user(target_user_id)
             
-            dm_embed = discord.Embed(title="✅ Your Product Has Arrived!", color=int(self.bot.config['success_color'], 16))
+            dm_embed = discord.Embed(title="✅ Your Product Has Arrived!", color=self.bot.success_color_int)
             if order.get('gift_recipient_id'):
                 purchaser = await self.bot.fetch_user(order['user_id'])
                 dm_embed.description=f"You have received a gift from {purchaser.mention}!"
@@ -327,7 +329,7 @@ class OrderProcessing(commands.Cog):
         top_products_str = "\n".join([f"**{name}**: `{count}` sold" for name, count in top_products[:5]])
         if not top_products_str: top_products_str = "No product sales yet."
 
-        embed = discord.Embed(title="📊 Sales Dashboard", color=int(self.bot.config['embed_color'], 16), timestamp=now)
+        embed = discord.Embed(title="📊 Sales Dashboard", color=self.bot.embed_color_int, timestamp=now)
         embed.add_field(name="💰 Total Revenue (All-Time)", value=f"₹{total_revenue:.2f}", inline=True)
         embed.add_field(name="📈 Revenue Today", value=f"₹{revenue_today:.2f}", inline=True)
         embed.add_field(name="📦 Orders Today", value=str(orders_today), inline=True)
@@ -356,7 +358,7 @@ class OrderProcessing(commands.Cog):
         except Exception as e:
             print(f"Error fetching customer for order info: {e}")
 
-        embed = discord.Embed(title=f"Details for Order `#{order_id}`", color=int(self.bot.config['embed_color'], 16))
+        embed = discord.Embed(title=f"Details for Order `#{order_id}`", color=self.bot.embed_color_int)
         embed.set_author(name=f"Order for {customer_mention}", icon_url=customer_avatar_url)
         
         order_time_str = order.get('timestamp')
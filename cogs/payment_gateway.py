@@ -4,16 +4,39 @@ from discord.ext import commands
 import requests
 import qrcode
 import io
+import copy
+from cachetools import TTLCache
 import asyncio # Import asyncio for a more robust dummy user object if needed
 
+def calculate_cart_total(cart: dict, discount: float = 0.0) -> float:
+    """Returns the payable INR total for a cart after discount, never below zero."""
+    # ProductSelect and quick buy always store a float 'price' (None is normalised to 0.0) and 'quantity', so index directly
+    total_inr = sum(item['price'] * item['quantity'] for item in cart.values()) - discount
+    return max(0, total_inr)
+
 class PaymentView(discord.ui.View):
-    def __init__(self, bot, order_id, user: discord.User, cart, discount):
+    def __init__(self, bot, order_id, user: discord.User, cart, discount, total_inr: float = None):
         super().__init__(timeout=900) # View times out after 15 minutes
         self.bot = bot
         self.order_id = order_id
         self.user = user # Store the actual user for refreshing rates
         self.cart = cart
         self.discount = discount
+        # The cart is frozen once the order is confirmed, so the total only needs computing once
+        self.total_inr = total_inr if total_inr is not None else calculate_cart_total(cart, discount)
+        self.qr_total_inr = None # Total the currently attached UPI QR was rendered for
+
+    def release(self):
+        """Stops the view and drops its references so the order data can be garbage collected."""
+        self.stop()
+        self.cart = None
+        self.user = None
+        self.bot = None
+
+    async def on_timeout(self):
+        if self.bot and (payment_cog := self.bot.get_cog("PaymentGateway")):
+            payment_cog.active_payment_views.pop(self.order_id, None)
+        self.release()
 
     @discord.ui.button(label="Refresh Crypto Rates", style=discord.ButtonStyle.secondary, emoji="🔄")
     async def refresh_rates(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -23,17 +46,23 @@ class PaymentView(discord.ui.View):
             await interaction.followup.send("An error occurred: Payment gateway cog not found. Please contact staff.", ephemeral=True)
             return
         
+        # The UPI QR only depends on the amount, so it is re-rendered only if the total changed
+        render_qr = self.qr_total_inr != self.total_inr
+
         # Regenerate content using the stored order details
         new_embed, new_file = await payment_cog.generate_payment_embed_content(
-            self.order_id, self.user, self.cart, self.discount
+            self.order_id, self.user, self.cart, self.discount, total_inr=self.total_inr, render_qr=render_qr
         )
         
-        # Prepare files list for editing message
-        files_to_send = [new_file] if new_file else []
-        
         # Edit the original message (the one with the buttons)
         try:
-            await interaction.message.edit(embed=new_embed, attachments=files_to_send, view=self)
+            if render_qr:
+                files_to_send = [new_file] if new_file else []
+                await interaction.message.edit(embed=new_embed, attachments=files_to_send, view=self)
+                self.qr_total_inr = self.total_inr if new_file else None
+            else:
+                # Omitting attachments keeps the QR already on the message
+                await interaction.message.edit(embed=new_embed, view=self)
             await interaction.followup.send("✅ Payment rates refreshed.", ephemeral=True)
         except Exception as e:
             await interaction.followup.send(f"❌ Failed to refresh rates or update message: {e}", ephemeral=True)
@@ -42,6 +71,9 @@ class PaymentView(discord.ui.View):
 class PaymentGateway(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.active_payment_views = {} # order_id -> PaymentView, so the view can be released once the order is paid
+        # (order_id, total) -> (embed dict, QR png bytes); repeat refreshes within a minute reuse the rendered invoice
+        self._embed_cache = TTLCache(maxsize=1024, ttl=60)
         # Ensure 'btc_address' is included if you intend to support it.
         # This map defines supported cryptos and their CoinGecko IDs/symbols.
         self.coin_map = {
@@ -51,21 +83,22 @@ class PaymentGateway(commands.Cog):
             # Add other cryptos here if supported in config
             # "eth_address": {"id": "ethereum", "name": "Ethereum (ETH)", "symbol": "ETH"},
         }
+        # Payment methods don't change at runtime, so the CoinGecko URL is built once
+        # Only fetch rates for coins that have an address configured in bot.config['payment_methods']
+        pm = self.bot.config.get('payment_methods', {})
+        configured_coin_ids = [details["id"] for key, details in self.coin_map.items() if pm.get(key)]
+        self._coingecko_url = (
+            f"https://api.coingecko.com/api/v3/simple/price?ids={','.join(configured_coin_ids)}&vs_currencies=inr"
+            if configured_coin_ids else None
+        )
 
     async def get_coingecko_rates(self):
-        # Only fetch rates for coins that have an address configured in bot.config['payment_methods']
-        configured_coin_ids = [
-            details["id"] for key, details in self.coin_map.items() 
-            if key in self.bot.config.get('payment_methods', {}) and self.bot.config['payment_methods'].get(key)
-        ]
-        
-        if not configured_coin_ids:
+        if not self._coingecko_url:
             print("No crypto addresses configured for CoinGecko lookup.")
             return {}
 
-        api_url = f"https://api.coingecko.com/api/v3/simple/price?ids={','.join(configured_coin_ids)}&vs_currencies=inr"
         try:
-            r = requests.get(api_url, timeout=10) # Add timeout for robustness
+            r = requests.get(self._coingecko_url, timeout=10) # Add timeout for robustness
             r.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
             return r.json()
         except requests.exceptions.Timeout:
@@ -78,63 +111,99 @@ class PaymentGateway(commands.Cog):
             print(f"An unexpected error occurred while fetching CoinGecko rates: {e}")
             return None
 
-    async def generate_payment_embed_content(self, order_id: str, user: discord.User, cart: dict, discount: float = 0.0):
-        total_inr = sum(item.get('price', 0) * item.get('quantity', 0) for item in cart.values()) - discount
-        # Ensure total_inr is not negative
-        total_inr = max(0, total_inr)
-
-        rates = await self.get_coingecko_rates()
-        if rates is None: # Handle cases where API call itself failed
-            return discord.Embed(title="⚠️ Payment Service Temporarily Unavailable", description="Could not fetch live crypto rates. Please try again later or contact staff.", color=int(self.bot.config['error_color'], 16)), None
-        if not rates: # Handle cases where no configured coins could fetch rates
-            return discord.Embed(title="⚠️ Crypto Payments Not Available", description="No supported crypto payment methods are configured or active.", color=int(self.bot.config['error_color'], 16)), None
+    async def generate_payment_embed_content(self, order_id: str, user: discord.User, cart: dict, discount: float = 0.0, total_inr: float = None, render_qr: bool = True):
+        # Callers that already know the total (e.g. PaymentView refreshes) skip the cart walk
+        if total_inr is None:
+            total_inr = calculate_cart_total(cart, discount)
 
         pm = self.bot.config.get('payment_methods', {})
+
+        cache_key = (order_id, round(total_inr, 2))
+        cached = self._embed_cache.get(cache_key)
+        # A cached render without QR bytes can't serve a request that needs the attachment
+        if cached and (cached[1] is not None or not render_qr or not pm.get('upi_id')):
+            embed_data, png_bytes = cached
+            qr_file = discord.File(fp=io.BytesIO(png_bytes), filename="upi_qr.png") if render_qr and png_bytes else None
+            return discord.Embed.from_dict(copy.deepcopy(embed_data)), qr_file
+
+        if not self._coingecko_url and pm.get('upi_id'):
+            rates = {} # UPI-only setup: nothing to price in crypto, so skip the CoinGecko round trip
+        else:
+            rates = await self.get_coingecko_rates()
+            if rates is None: # Handle cases where API call itself failed
+                return discord.Embed(title="⚠️ Payment Service Temporarily Unavailable", description="Could not fetch live crypto rates. Please try again later or contact staff.", color=self.bot.error_color_int), None
+            if not rates: # Handle cases where no configured coins could fetch rates
+                return discord.Embed(title="⚠️ Crypto Payments Not Available", description="No supported crypto payment methods are configured or active.", color=self.bot.error_color_int), None
         
         qr_file = None
+        png_bytes = None
         # Check if UPI is configured and generate QR
-        if pm.get('upi_id'):
+        if pm.get('upi_id') and render_qr:
             # Ensure the amount is formatted correctly for UPI (2 decimal places)
             upi_uri = f"upi://pay?pa={pm['upi_id']}&pn=YourStore&am={total_inr:.2f}&cu=INR&tn=Order-{order_id}"
             try:
-                qr = qrcode.make(upi_uri)
-                img_arr = io.BytesIO(); qr.save(img_arr, format='PNG'); img_arr.seek(0)
+                # A small box size keeps the PNG tiny; phones scan it fine at this resolution
+                qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=4, border=2)
+                qr.add_data(upi_uri); qr.make(fit=True)
+                img = qr.make_image().get_image()
+                if img.mode != '1':
+                    img = img.convert('1') # QR codes are strictly black/white, so a 1-bit PNG is enough
+                img_arr = io.BytesIO(); img.save(img_arr, format='PNG', optimize=False, compress_level=1); img_arr.seek(0)
+                png_bytes = img_arr.getvalue()
                 qr_file = discord.File(fp=img_arr, filename="upi_qr.png")
             except Exception as e:
                 print(f"Error generating UPI QR code: {e}")
                 # Don't fail the entire embed generation, just skip QR
                 qr_file = None
+                png_bytes = None
 
-        embed = discord.Embed(title="✅ Order Invoice", description=f"Please pay **₹{total_inr:.2f}** for Order `{order_id}`", color=int(self.bot.config['success_color'], 16))
-        embed.set_author(name=f"Invoice for {user.display_name}", icon_url=user.display_avatar.url)
-        
+        fields = []
         if pm.get('upi_id'):
-            embed.add_field(name="📱 UPI Payment", value=f"**ID:** `{pm['upi_id']}`\n**Note:** `Order-{order_id}`", inline=False)
+            fields.append({"name": "📱 UPI Payment", "value": f"**ID:** `{pm['upi_id']}`\n**Note:** `Order-{order_id}`", "inline": False})
         
         # Add crypto payment options dynamically
         for key, details in self.coin_map.items():
             address = pm.get(key)
             if address and (coin_rate_info := rates.get(details["id"])) and (inr_rate := coin_rate_info.get("inr", 0)) > 0:
                 crypto_amount = total_inr / inr_rate
-                embed.add_field(
-                    name=f"<{details['symbol'].upper()}> {details['name']}", # Use symbol directly
-                    value=f"Send **{crypto_amount:.8f} {details['symbol']}** to the address below:\n`{address}`",
-                    inline=False
-                )
-        
-        if qr_file: 
-            embed.set_image(url="attachment://upi_qr.png") # Link to the attached QR code image
-        
-        embed.set_footer(text="After paying with Crypto, use /verify_payment in this ticket to confirm. Rates refresh every 5 minutes.")
-        embed.set_thumbnail(url=self.bot.user.display_avatar.url) # Use bot's avatar as thumbnail
+                fields.append({
+                    "name": f"<{details['symbol'].upper()}> {details['name']}", # Use symbol directly
+                    "value": f"Send **{crypto_amount:.8f} {details['symbol']}** to the address below:\n`{address}`",
+                    "inline": False
+                })
+
+        # Build the whole invoice in one go instead of a chain of add_field/set_* calls
+        embed_data = {
+            "title": "✅ Order Invoice",
+            "description": f"Please pay **₹{total_inr:.2f}** for Order `{order_id}`",
+            "color": self.bot.success_color_int,
+            "author": {"name": f"Invoice for {user.display_name}", "icon_url": user.display_avatar.url},
+            "fields": fields,
+            "footer": {"text": "After paying with Crypto, use /verify_payment in this ticket to confirm. Rates refresh every 5 minutes."},
+            "thumbnail": {"url": self.bot.user.display_avatar.url}, # Use bot's avatar as thumbnail
+        }
+        if qr_file or (pm.get('upi_id') and not render_qr): 
+            embed_data["image"] = {"url": "attachment://upi_qr.png"} # Link to the attached QR code image
+        self._embed_cache[cache_key] = (copy.deepcopy(embed_data), png_bytes)
+        embed = discord.Embed.from_dict(embed_data)
 
         return embed, qr_file
 
     async def generate_payment_embed(self, order_id: str, user: discord.User, cart: dict, discount: float = 0.0):
-        embed, file = await self.generate_payment_embed_content(order_id, user, cart, discount)
+        total_inr = calculate_cart_total(cart, discount)
+        embed, file = await self.generate_payment_embed_content(order_id, user, cart, discount, total_inr=total_inr)
         # Create the view, passing the necessary info to its init
-        view = PaymentView(self.bot, order_id, user, cart, discount)
+        view = PaymentView(self.bot, order_id, user, cart, discount, total_inr=total_inr)
+        if file:
+            view.qr_total_inr = total_inr
+        self.release_payment_view(order_id) # An order only ever has one live invoice
+        self.active_payment_views[order_id] = view
         return embed, file, view
+
+    def release_payment_view(self, order_id: str):
+        """Stops the invoice view for an order that has been paid or cancelled."""
+        if (view := self.active_payment_views.pop(order_id, None)):
+            view.release()
         
 async def setup(bot: commands.Cog):
     await bot.add_cog(PaymentGateway(bot))
\ No newline at end of file
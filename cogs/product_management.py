@@ -4,8 +4,12 @@ from discord.ext import commands
 from discord import app_commands
 import uuid
 import re
+import asyncio
+import heapq
 import datetime
+from dataclasses import dataclass
 from utils.checks import is_owner
+from utils.text import THREAD_NAME_TABLE
 
 # A forward import is needed for type hinting without circular import errors
 from typing import TYPE_CHECKING
@@ -13,6 +17,35 @@ if TYPE_CHECKING:
     # These imports are only for type checking, not loaded at runtime
     from cogs.ticket_system import ShoppingCartView, StaffTicketView
 
+# Compiled once; used by /set_product_emoji
+_EMOJI_RE = re.compile(r'^<a?:\w+:\d+>$') # Animated and non-animated custom emojis
+_STARS = tuple("⭐" * i for i in range(6)) # Review star strings indexed by rating (1-5)
+
+
+_ticket_views = None
+
+def _get_ticket_views():
+    """Imports the ticket views on first use; a top-level import would be circular."""
+    global _ticket_views
+    if _ticket_views is None:
+        from cogs.ticket_system import ShoppingCartView, StaffTicketView
+        _ticket_views = (ShoppingCartView, StaffTicketView)
+    return _ticket_views
+
+
+def _parse_num(raw: str, caster, *, min_val=None, min_error: str = None):
+    """Strips and converts a modal value. Returns (value, error); blank input gives (None, None)."""
+    value = raw.strip()
+    if not value:
+        return None, None
+    try:
+        number = caster(value)
+        if min_val is not None and number < min_val:
+            raise ValueError(min_error)
+    except ValueError as e:
+        return None, e
+    return number, None
+
 
 class ProductModal(discord.ui.Modal, title="Product Details"):
     def __init__(self, bot, product_id=None, existing_product=None):
@@ -73,65 +106,48 @@ class ProductModal(discord.ui.Modal, title="Product Details"):
 
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True) # Defer immediately for modal submission
-        products = await self.bot.load_json('products') # Using bot's load_json
-        
-        price_val = None
-        stock_val = -1 # Default to infinite stock
-        renewal_val = None
-        
         # Validate and convert price
-        if self.price_input.value.strip(): # Check if input is not empty or just whitespace
-            try:
-                price_val = float(self.price_input.value.strip())
-                if price_val < 0: 
-                    raise ValueError("Price cannot be negative.")
-            except ValueError as e:
-                await interaction.followup.send(f"❌ Invalid price format: {e}. Please enter a valid positive number for price (e.g., 100.00).", ephemeral=True)
-                return
-        else: # If price is required but not provided
+        price_val, error = _parse_num(self.price_input.value, float, min_val=0, min_error="Price cannot be negative.")
+        if error:
+            await interaction.followup.send(f"❌ Invalid price format: {error}. Please enter a valid positive number for price (e.g., 100.00).", ephemeral=True)
+            return
+        if price_val is None: # If price is required but not provided
             await interaction.followup.send("❌ Product price is required. Please enter a numerical value.", ephemeral=True)
             return
 
         # Validate and convert stock
-        if self.stock_input.value.strip(): # Check if input is not empty or just whitespace
-            try:
-                stock_val = int(self.stock_input.value.strip())
-                if stock_val < -1: 
-                    raise ValueError("Stock cannot be less than -1 (use -1 for infinite).")
-            except ValueError as e:
-                await interaction.followup.send(f"❌ Invalid stock quantity format: {e}. Please enter an integer (-1 for infinite).", ephemeral=True)
-                return
-        else: # If stock is required but not provided
+        stock_val, error = _parse_num(self.stock_input.value, int, min_val=-1, min_error="Stock cannot be less than -1 (use -1 for infinite).")
+        if error:
+            await interaction.followup.send(f"❌ Invalid stock quantity format: {error}. Please enter an integer (-1 for infinite).", ephemeral=True)
+            return
+        if stock_val is None: # If stock is required but not provided
             await interaction.followup.send("❌ Stock quantity is required. Please enter an integer.", ephemeral=True)
             return
 
         # Validate and convert renewal period (optional)
-        if self.renewal_period_days_input.value.strip():
-            try:
-                renewal_val = int(self.renewal_period_days_input.value.strip())
-                if renewal_val <= 0: 
-                    raise ValueError("Renewal period must be a positive integer in days.")
-            except ValueError as e:
-                await interaction.followup.send(f"❌ Invalid renewal period format: {e}. Please enter a positive number of days (e.g., 30).", ephemeral=True)
-                return
+        renewal_val, error = _parse_num(self.renewal_period_days_input.value, int, min_val=1, min_error="Renewal period must be a positive integer in days.")
+        if error:
+            await interaction.followup.send(f"❌ Invalid renewal period format: {error}. Please enter a positive number of days (e.g., 30).", ephemeral=True)
+            return
             
-        # Get old product data to preserve existing optional fields like emoji and image_url
-        old_product_data = products.get(self.product_id, {})
-        old_stock = old_product_data.get('stock', 0) # For restock notification logic
-        
-        # Create or update product data. Preserve emoji and image_url.
-        products[self.product_id] = {
-            "name": self.name_input.value.strip(), # Ensure name is stripped of whitespace
-            "description": self.description_input.value.strip(), # Ensure description is stripped
-            "price": price_val,
-            "stock": stock_val,
-            # Retain existing emoji and image_url. They are not updated via this modal.
-            "emoji": old_product_data.get('emoji', None), 
-            "image_url": old_product_data.get('image_url', None), 
-            "renewal_period_days": renewal_val 
-        }
-        
-        await self.bot.save_json('products', products) # Save updated products data
+        # All inputs are valid; only now fetch the catalog and build the product
+        product_cog = self.bot.get_cog("ProductManagement")
+        products = await product_cog.get_products()
+        product_name = self.name_input.value.strip() # Ensure name is stripped of whitespace
+
+        old_stock = products.get(self.product_id, {}).get('stock', 0) # For restock notification logic
+        
+        # Create or update product data in place. Emoji and image_url are not edited via this modal, so they are retained.
+        product = products.setdefault(self.product_id, {"emoji": None, "image_url": None})
+        product.update(
+            name=product_name,
+            description=self.description_input.value.strip(), # Ensure description is stripped
+            price=price_val,
+            stock=stock_val,
+            renewal_period_days=renewal_val
+        )
+        
+        await product_cog.save_product(self.product_id, products) # Only this product's row is written
         
         # Restock notification logic: if product was out of stock and is now in stock
         if old_stock == 0 and stock_val > 0: 
@@ -139,22 +155,28 @@ class ProductModal(discord.ui.Modal, title="Product Details"):
             user_ids_to_notify = notifications.pop(self.product_id, []) # Get and remove entries for this product
             
             if user_ids_to_notify:
-                notification_count = 0
-                for user_id in user_ids_to_notify:
-                    try:
-                        user = await self.bot.fetch_user(user_id)
-                        await user.send(f"🎉 **Restock Alert!**\nThe product '{self.name_input.value.strip()}' is now back in stock! Check it out in the store: `/browse`")
-                        notification_count += 1
-                    except discord.Forbidden: # User has DMs disabled
-                        print(f"Failed to send restock notification to user {user_id}: DMs disabled.")
-                    except Exception as e:
-                        print(f"Failed to send restock notification to user {user_id}: {type(e).__name__}: {e}")
-                await self.bot.save_json('notifications', notifications) # Save updated notifications (without sent entries)
+                restock_message = f"🎉 **Restock Alert!**\nThe product '{product_name}' is now back in stock! Check it out in the store: `/browse`"
+                dm_semaphore = asyncio.Semaphore(10) # Keep concurrent DMs well under Discord's rate limits
+
+                async def notify_user(user_id) -> int:
+                    async with dm_semaphore:
+                        try:
+                            user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id) # Cache first, REST only on a miss
+                            await user.send(restock_message)
+                            return 1
+                        except discord.Forbidden: # User has DMs disabled
+                            print(f"Failed to send restock notification to user {user_id}: DMs disabled.")
+                        except Exception as e:
+                            print(f"Failed to send restock notification to user {user_id}: {type(e).__name__}: {e}")
+                        return 0
+
+                notification_count = sum(await asyncio.gather(*(notify_user(user_id) for user_id in user_ids_to_notify)))
+                self.bot.queue_save('notifications', notifications) # Save updated notifications (without sent entries)
                 
-                await interaction.followup.send(f"✅ Product `{self.name_input.value.strip()}` (ID: `{self.product_id}`) saved. Sent {notification_count} restock alerts to interested users.", ephemeral=True)
+                await interaction.followup.send(f"✅ Product `{product_name}` (ID: `{self.product_id}`) saved. Sent {notification_count} restock alerts to interested users.", ephemeral=True)
                 return # Exit early if restock alert was sent
 
-        await interaction.followup.send(f"✅ Product `{self.name_input.value.strip()}` (ID: `{self.product_id}`) has been successfully saved/updated.", ephemeral=True)
+        await interaction.followup.send(f"✅ Product `{product_name}` (ID: `{self.product_id}`) has been successfully saved/updated.", ephemeral=True)
 
 
 class QuickAddModal(discord.ui.Modal, title="Quick Add to Cart"):
@@ -188,24 +210,69 @@ class QuickAddModal(discord.ui.Modal, title="Quick Add to Cart"):
             await interaction.response.send_message("❌ Product management system is currently unavailable. Please notify a bot administrator.", ephemeral=True)
 
 
+@dataclass(slots=True, frozen=True)
+class ProductDisplay:
+    """Pre-formatted browse fragments for one product; slotted since one is held per catalog entry."""
+    name_line: str
+    price_str: str
+    renewal: str
+    desc_line: str
+
+
+def _build_product_display(pid: str, p: dict) -> ProductDisplay:
+    """Formats the parts of a product's browse entry that only change when the product is edited."""
+    # Ensure price is formatted correctly, handle None price
+    price = f"₹{p.get('price', 0.0):.2f}" if p.get('price') is not None else "Custom Quote" 
+    emoji = p.get('emoji', '📦') # Use custom emoji or a default box emoji
+
+    # Add renewal period information if available
+    renewal_info = ""
+    if p.get('renewal_period_days'):
+        renewal_info = f"\n> **Renews Every:** {p['renewal_period_days']} days"
+
+    # Use product.get('description') in the field value itself
+    product_description = p.get('description', 'No description provided.').strip()
+    if product_description:
+        product_description = f"> **Description:** {product_description}\n"
+    else:
+        product_description = "" # No description line if empty
+
+    # Check if name is None or empty and provide a fallback.
+    product_name_display = p.get('name')
+    if not product_name_display:
+        product_name_display = "Unnamed Product"
+
+    return ProductDisplay(
+        name_line=f"{emoji} {product_name_display} (ID: `{pid}`)", # Handle missing product name
+        price_str=price,
+        renewal=renewal_info,
+        desc_line=product_description,
+    )
+
+
 class ProductBrowserView(discord.ui.View):
-    def __init__(self, bot, products: dict):
+    def __init__(self, bot, products, display_cache: dict = None):
         super().__init__(timeout=180) # View times out after 3 minutes of inactivity
         self.bot = bot
-        # Convert dictionary items to a list of (id, data) tuples for easy pagination
-        self.products = list(products.items()) 
+        self.display_cache = display_cache or {} # pid -> ProductDisplay
         self.current_page = 0
         self.items_per_page = 3 # Number of products to display per page
+        # (id, data) pairs for pagination; the cog passes its shared snapshot so views don't each copy the catalog
+        self._items = products if isinstance(products, tuple) else tuple(products.items())
+        self._total_pages = max(1, -(-len(self._items) // self.items_per_page)) # Ceiling division for total pages
 
-    async def get_page_embed(self):
+    def _current_page_items(self) -> list:
         start_index = self.current_page * self.items_per_page
-        end_index = start_index + self.items_per_page
-        page_products = self.products[start_index:end_index] # Get products for the current page
-        
+        return self._items[start_index:start_index + self.items_per_page] # Get products for the current page
+
+    async def get_page_embed(self):
+        return self._render_embed(self._current_page_items())
+
+    def _render_embed(self, page_products: list) -> discord.Embed:
         embed = discord.Embed(
             title="🛍️ Our Products", 
             description="Browse through our catalog using the navigation buttons. Click 'Add to Cart' to start a quick purchase.", 
-            color=int(self.bot.config['embed_color'], 16)
+            color=self.bot.embed_color_int
         )
         
         # Set thumbnail using the image_url of the first product on the page, if available
@@ -216,9 +283,8 @@ class ProductBrowserView(discord.ui.View):
             embed.description = "There are no products to display on this page or in the store currently."
         
         for pid, p in page_products:
-            # Ensure price is formatted correctly, handle None price
-            price = f"₹{p.get('price', 0.0):.2f}" if p.get('price') is not None else "Custom Quote" 
-            emoji = p.get('emoji', '📦') # Use custom emoji or a default box emoji
+            # Static fragments come precomputed from the cog; only stock is formatted live
+            display = self.display_cache.get(pid) or _build_product_display(pid, p)
             
             try: # Ensure stock is int before using
                 stock_num = int(p.get('stock', 0)) 
@@ -232,39 +298,21 @@ class ProductBrowserView(discord.ui.View):
                 stock_status = f"{stock_num} in stock"
             else: 
                 stock_status = "Out of Stock 🚫" # Clearly indicate out of stock
-            
-            # Add renewal period information if available
-            renewal_info = ""
-            if p.get('renewal_period_days'):
-                renewal_info = f"\n> **Renews Every:** {p['renewal_period_days']} days"
-
-            # Use product.get('description') in the field value itself
-            product_description = p.get('description', 'No description provided.').strip()
-            if product_description:
-                product_description = f"> **Description:** {product_description}\n"
-            else:
-                product_description = "" # No description line if empty
                 
             field_value = (
-                f"> **Price:** {price}\n"
+                f"> **Price:** {display.price_str}\n"
                 f"> **Stock:** {stock_status}"
-                f"{renewal_info}\n"
-                f"{product_description}" # Add description here
+                f"{display.renewal}\n"
+                f"{display.desc_line}" # Add description here
             ).strip() # Remove trailing newlines/spaces
-
-            # Check if name is None or empty and provide a fallback.
-            product_name_display = p.get('name')
-            if not product_name_display:
-                product_name_display = "Unnamed Product"
             
             embed.add_field(
-                name=f"{emoji} {product_name_display} (ID: `{pid}`)", # Handle missing product name
+                name=display.name_line,
                 value=field_value, 
                 inline=False # Each product takes its own line
             )
             
-        total_pages = -(-len(self.products) // self.items_per_page) # Ceiling division for total pages
-        embed.set_footer(text=f"Page {self.current_page + 1} / {total_pages}")
+        embed.set_footer(text=f"Page {self.current_page + 1} / {self._total_pages}")
         return embed
 
     async def update_view(self, interaction: discord.Interaction):
@@ -273,7 +321,7 @@ class ProductBrowserView(discord.ui.View):
         # Disable/enable buttons based on current page
         self.children[0].disabled = self.current_page == 0 # Previous button
         # Next button disabled if current page is the last page (or there are no products)
-        self.children[1].disabled = (self.current_page + 1) * self.items_per_page >= len(self.products)
+        self.children[1].disabled = self.current_page + 1 >= self._total_pages
         
         await interaction.response.edit_message(embed=embed, view=self)
 
@@ -289,9 +337,7 @@ class ProductBrowserView(discord.ui.View):
 
     @discord.ui.button(label="Add to Cart", style=discord.ButtonStyle.success, emoji="🛒", row=1, custom_id="browser_add_to_cart")
     async def quick_add_to_cart(self, interaction: discord.Interaction, button: discord.ui.Button):
-        start_index = self.current_page * self.items_per_page
-        end_index = start_index + self.items_per_page
-        page_products = self.products[start_index:end_index]
+        page_products = self._current_page_items()
 
         # Only send modal if there are products on the current page to select from
         if not page_products:
@@ -308,17 +354,89 @@ class ProductManagement(commands.Cog):
         # Initialize active_tickets in bot if not already present. This is a shared state.
         if not hasattr(bot, 'active_tickets'):
             self.bot.active_tickets = {}
+        self._index_revision = None # data_revisions['products'] the autocomplete/display indexes were built from
+        self._autocomplete_index = [] # (pid, pid_lower, name_lower, label), rebuilt whenever products reload
+        self._display_cache = {} # pid -> browse embed fragments, rebuilt alongside the autocomplete index
+        self._order_date_display = {} # (order_id, timestamp) -> Discord date string for /myorders; order records stay untouched
+        self._products_snapshot = () # Immutable (pid, product) pairs shared by every /browse view
+        self._staff_mentions_key = None
+        self._staff_mentions = ''
+
+    def get_staff_mentions(self) -> str:
+        """Staff role pings for new tickets, rebuilt only when /add_staff_role or /remove_staff_role changes the list."""
+        role_ids = tuple(self.bot.config.get('staff_role_ids', []))
+        if role_ids != self._staff_mentions_key:
+            self._staff_mentions = ' '.join(f'<@&{rid}>' for rid in role_ids)
+            self._staff_mentions_key = role_ids
+        return self._staff_mentions
+
+    async def get_products(self) -> dict:
+        """Returns the products dict from bot.cache, rebuilding the local indexes only after a products save."""
+        products = await self.bot.load_json('products')
+        revision = self.bot.data_revisions.get('products', 0)
+        if revision != self._index_revision:
+            self._rebuild_product_indexes(products)
+            # Don't pin indexes built from an empty result (e.g. database briefly unavailable); try again next call
+            self._index_revision = revision if products else None
+        return products
+
+    async def save_products(self, products: dict):
+        """Queues a products save (which updates bot.cache) and rebuilds the local indexes without a reload."""
+        self.bot.queue_save('products', products)
+        self._rebuild_product_indexes(products)
+        self._index_revision = self.bot.data_revisions.get('products', 0)
+
+    async def save_product(self, product_id: str, products: dict):
+        """Persists a single product that was changed in place inside the cached products dict."""
+        await self.bot.save_product(product_id, products[product_id])
+        self._rebuild_product_indexes(products)
+        self._index_revision = self.bot.data_revisions.get('products', 0)
+
+    def _user_order_ids(self, user_id: int) -> list:
+        """Order IDs placed by a user, from the index the bot rebuilds on every orders load/save."""
+        return self.bot.cache.get('user_orders_idx', {}).get(user_id, [])
+
+    def _rebuild_product_indexes(self, products: dict):
+        """Precomputes autocomplete search keys and browse display strings once per products change."""
+        index = []
+        display_cache = {}
+        for pid, product in products.items():
+            product_name = product.get('name') or 'Unnamed Product'
+            index.append((pid, pid.lower(), product_name.lower(), f"{product_name} (ID: {pid})"[:100]))
+            try:
+                display_cache[pid] = _build_product_display(pid, product)
+            except Exception as e: # A malformed product just falls back to live formatting
+                print(f"Warning: Could not precompute display for product {pid}: {e}")
+        self._autocomplete_index = index
+        self._display_cache = display_cache
+        self._products_snapshot = tuple(products.items())
 
     async def product_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
         """Autocomplete function for product IDs based on name or ID."""
-        products = await self.bot.load_json('products') # Load products from JSON
+        await self.get_products() # Refreshes the autocomplete index if products changed
+        current_lower = current.lower()
         choices = []
-        for pid, product in products.items():
-            product_name = product.get('name', 'Unnamed Product')
+        for pid, pid_lower, name_lower, label in self._autocomplete_index:
             # Check if current input matches product name or ID (case-insensitive)
-            if current.lower() in product_name.lower() or current.lower() in pid.lower():
-                choices.append(app_commands.Choice(name=f"{product_name} (ID: {pid})", value=pid)) # More descriptive label
-        return choices[:25] # Discord API limit is 25 choices
+            if current_lower in name_lower or current_lower in pid_lower:
+                choices.append(app_commands.Choice(name=label, value=pid)) # More descriptive label
+                if len(choices) == 25: # Discord API limit is 25 choices
+                    break
+        return choices
+
+    async def notify_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+        """Autocomplete for /notify_me, which only accepts out-of-stock products."""
+        products = await self.get_products()
+        current_lower = current.lower()
+        choices = []
+        for pid, pid_lower, name_lower, label in self._autocomplete_index:
+            if products.get(pid, {}).get('stock') != 0: # Stock is read live since purchases change it
+                continue
+            if current_lower in name_lower or current_lower in pid_lower:
+                choices.append(app_commands.Choice(name=label, value=pid))
+                if len(choices) == 25: # Discord API limit is 25 choices
+                    break
+        return choices
 
     async def execute_quick_buy(self, interaction: discord.Interaction, product_id: str):
         """
@@ -330,7 +448,7 @@ class ProductManagement(commands.Cog):
             # Change this from ephemeral=True to ephemeral=False
             await interaction.response.defer(ephemeral=False) # <--- THIS WAS CHANGED
 
-        products = await self.bot.load_json('products') # Load current products data
+        products = await self.get_products() # Load current products data
         product_id = product_id.upper() # Ensure consistent casing
         product = products.get(product_id)
         
@@ -357,12 +475,11 @@ class ProductManagement(commands.Cog):
             return
 
         try:
-            # Dynamically import ShoppingCartView and StaffTicketView here to avoid circular imports at file load time
-            from cogs.ticket_system import ShoppingCartView, StaffTicketView
+            ShoppingCartView, StaffTicketView = _get_ticket_views()
             
             # Construct a dynamic thread name (max 100 characters)
             product_name_for_thread = product.get('name', 'Product') # Default if name is missing
-            sanitized_name = re.sub(r'[^a-zA-Z0-9-]', '', product_name_for_thread).strip()
+            sanitized_name = product_name_for_thread.translate(THREAD_NAME_TABLE).strip()
             if not sanitized_name: sanitized_name = "item" # Fallback if sanitized name is empty
             
             base_thread_name = f"🛒-{interaction.user.name}"
@@ -381,24 +498,25 @@ class ProductManagement(commands.Cog):
             await thread.add_user(interaction.user) # Add the user to the private thread
             
             # Initialize cart with the quick-bought product
-            # Ensure price is handled if None
-            initial_price = product.get('price', 0.0)
+            # Cart items always carry a float price; Custom Quote products (NULL price) go in at 0.0
+            initial_price = product.get('price') or 0.0
             cart = {product_id: {"name": product.get('name', 'Unnamed Product'), "price": initial_price, "quantity": 1}}
             
             # Store ticket state in bot.active_tickets in memory
             self.bot.active_tickets[thread.id] = {
                 "cart": cart, 
+                "cart_total": initial_price, # Running total, updated alongside the cart
                 "discount": 0.0, 
                 "creator_id": interaction.user.id,
                 "category": "BUY", # Explicitly set category
                 "status": "Open",
                 "cart_message_id": None # Will store the ID of the cart message
             }
+            self.bot.append_ticket_event(thread.id, {"event": "open", **self.bot.active_tickets[thread.id]})
 
             # Instantiate ShoppingCartView with products (needed for ProductSelect options)
             # It will load fresh products dynamically when needed.
-            current_products_for_view = await self.bot.load_json('products')
-            view = ShoppingCartView(self.bot, current_products_for_view)
+            view = ShoppingCartView(self.bot, products)
             
             # Prepare initial cart embed for the ticket
             total = initial_price # Total for a single item
@@ -406,20 +524,21 @@ class ProductManagement(commands.Cog):
             embed = discord.Embed(
                 title="🛒 Your Shopping Cart", 
                 description=description, 
-                color=int(self.bot.config['embed_color'], 16),
+                color=self.bot.embed_color_int,
                 timestamp=datetime.datetime.now(datetime.timezone.utc)
             )
             embed.set_footer(text=f"Grand Total: ₹{total:.2f}")
 
             # Mentions for staff roles
-            mentions = ' '.join([f'<@&{rid}>' for rid in self.bot.config.get('staff_role_ids', [])])
+            mentions = self.get_staff_mentions()
             
             # Send initial cart message in the thread
             cart_message = await thread.send(content=f"Welcome, {interaction.user.mention}! Your item has been added to the cart.\n{mentions}", embed=embed, view=view)
             self.bot.active_tickets[thread.id]['cart_message_id'] = cart_message.id # Store message ID for later updates
+            self.bot.append_ticket_event(thread.id, {"event": "cart_message", "cart_message_id": cart_message.id})
             
             # Send staff controls separately
-            staff_control_embed = discord.Embed(description="--- **Staff Controls** ---", color=int(self.bot.config['embed_color'], 16))
+            staff_control_embed = discord.Embed(description="--- **Staff Controls** ---", color=self.bot.embed_color_int)
             await thread.send(embed=staff_control_embed, view=StaffTicketView(self.bot, ticket_creator=interaction.user))
         
         except discord.errors.Forbidden:
@@ -439,13 +558,14 @@ class ProductManagement(commands.Cog):
     @is_owner()
     @app_commands.autocomplete(product_id=product_autocomplete) # Autocomplete uses the cog's own method
     async def edit_product(self, interaction: discord.Interaction, product_id: str):
-        products = await self.bot.load_json('products') # Load products data
+        products = await self.get_products() # Load products data
         product_id = product_id.upper() # Ensure consistent casing
-        if not products.get(product_id):
+        existing_product = products.get(product_id)
+        if not existing_product:
             await interaction.response.send_message("❌ Product ID not found. Please ensure you enter a valid product ID to edit.", ephemeral=True)
             return
         # The modal handles its own deferral and response.
-        await interaction.response.send_modal(ProductModal(self.bot, product_id=product_id, existing_product=products.get(product_id)))
+        await interaction.response.send_modal(ProductModal(self.bot, product_id=product_id, existing_product=existing_product))
 
     # --- NEW COMMAND ADDED HERE ---
     @app_commands.command(name="set_product_emoji", description="[OWNER] Set or update the emoji for a product.")
@@ -459,14 +579,14 @@ class ProductManagement(commands.Cog):
         await interaction.response.defer(ephemeral=True)
 
         # Validate the emoji format using regex. Allows for animated and non-animated emojis.
-        if not re.match(r'^<a?:\w+:\d+>$', emoji.strip()):
+        if not _EMOJI_RE.match(emoji.strip()):
             await interaction.followup.send(
                 "❌ Invalid emoji format. Please provide a custom emoji in the correct format: `<:emoji_name:emoji_id:>` or `<a:emoji_name:emoji_id:>` for animated emojis.",
                 ephemeral=True
             )
             return
             
-        products = await self.bot.load_json('products')
+        products = await self.get_products()
         product_id = product_id.upper()
 
         if product_id not in products:
@@ -475,7 +595,7 @@ class ProductManagement(commands.Cog):
             
         # Update the emoji for the specified product
         products[product_id]['emoji'] = emoji.strip()
-        await self.bot.save_json('products', products)
+        await self.save_product(product_id, products)
         
         product_name = products[product_id].get('name', 'Unnamed Product')
         await interaction.followup.send(f"✅ Successfully updated the emoji for `{product_name}` to {emoji.strip()}.", ephemeral=True)
@@ -484,12 +604,12 @@ class ProductManagement(commands.Cog):
     @app_commands.command(name="browse", description="Browse all available products in an interactive menu.")
     async def browse(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=False) # Changed to public response
-        products = await self.bot.load_json('products') # Load products data
+        products = await self.get_products() # Load products data
         if not products:
             await interaction.followup.send("There are no products in the store yet. Please check back later!", ephemeral=False) # Changed to public response
             return
 
-        view = ProductBrowserView(self.bot, products)
+        view = ProductBrowserView(self.bot, self._products_snapshot, display_cache=self._display_cache)
         embed = await view.get_page_embed()
 
         # Set initial button states for the first page
@@ -509,16 +629,18 @@ class ProductManagement(commands.Cog):
     @app_commands.command(name="shop_stats", description="View public statistics about the store.")
     async def shop_stats(self, interaction: discord.Interaction):
         await interaction.response.defer() # Defer publicly
-        orders = await self.bot.load_json('orders') # Load orders data
-        products = await self.bot.load_json('products') # Load products data
+        products = await self.get_products() # Load products data
         
-        # Count only 'Delivered' orders for statistics
-        total_orders = len([o for o in orders.values() if o.get('status') == 'Delivered'])
+        # Count only 'Delivered' orders for statistics; the bot keeps this count current on every orders load/save
+        total_orders = self.bot.stats.get('delivered_orders')
+        if total_orders is None:
+            orders = await self.bot.load_json('orders') # Load orders data
+            total_orders = sum(1 for o in orders.values() if o.get('status') == 'Delivered')
         total_products_available = len(products)
         
         embed = discord.Embed(
             title="📊 Store Statistics", 
-            color=int(self.bot.config['embed_color'], 16),
+            color=self.bot.embed_color_int,
             timestamp=datetime.datetime.now(datetime.timezone.utc)
         )
         embed.add_field(name="Total Products Available", value=f"`{total_products_available}`", inline=True)
@@ -528,10 +650,10 @@ class ProductManagement(commands.Cog):
         await interaction.followup.send(embed=embed)
         
     @app_commands.command(name="notify_me", description="Get a DM when an out-of-stock product is available again.")
-    @app_commands.autocomplete(product_id=product_autocomplete) # Autocomplete uses the cog's own method
+    @app_commands.autocomplete(product_id=notify_autocomplete) # Only suggests out-of-stock products
     async def notify_me(self, interaction: discord.Interaction, product_id: str):
         await interaction.response.defer(ephemeral=True) # Defer ephemerally
-        products = await self.bot.load_json('products') # Load products data
+        products = await self.get_products() # Load products data
         product_id = product_id.upper() # Ensure consistent casing
         product = products.get(product_id)
         
@@ -542,15 +664,14 @@ class ProductManagement(commands.Cog):
         if stock != 0:
             await interaction.followup.send("✅ Good news! That product is already in stock. You can purchase it now!", ephemeral=True); return
         
-        notifications = await self.bot.load_json('notifications') # Load notifications data
-        if product_id not in notifications:
-            notifications[product_id] = [] # Initialize list for this product if it doesn't exist
+        notifications = await self.bot.load_json('notifications') # Cached product_id -> set of user IDs
+        subscribers = notifications.setdefault(product_id, set()) # Initialize set for this product if it doesn't exist
         
-        if interaction.user.id in notifications[product_id]:
+        if interaction.user.id in subscribers:
             await interaction.followup.send("👍 You're already on the notification list for this item. We'll let you know when it's back!", ephemeral=True); return
         
-        notifications[product_id].append(interaction.user.id) # Add user to notification list
-        await self.bot.save_json('notifications', notifications) # Save updated notifications
+        subscribers.add(interaction.user.id) # Add user to notification list
+        self.bot.queue_save('notifications', notifications) # Write-behind save of the cached dict
         
         await interaction.followup.send(f"✅ You're on the list! I'll DM you when '{product.get('name', 'Unnamed Product')}' is back in stock.", ephemeral=True)
 
@@ -565,7 +686,7 @@ class ProductManagement(commands.Cog):
     ])
     async def review(self, interaction: discord.Interaction, product_id: str, rating: app_commands.Choice[int], comment: str):
         await interaction.response.defer(ephemeral=True) # Defer ephemerally
-        products = await self.bot.load_json('products') # Load products data
+        products = await self.get_products() # Load products data
         product_id = product_id.upper() # Ensure consistent casing
         product = products.get(product_id)
         
@@ -573,13 +694,10 @@ class ProductManagement(commands.Cog):
             await interaction.followup.send("❌ That Product ID doesn't exist in our catalog.", ephemeral=True); return
         
         # Check if user has purchased this product (good practice for review authenticity)
-        orders = await self.bot.load_json('orders') # Load orders data
-        user_has_purchased = any(
-            order.get('user_id') == interaction.user.id and 
-            order.get('status') == 'Delivered' and # Only allow reviews for delivered orders
-            product_id in order.get('items', {})
-            for order in orders.values()
-        )
+        # Only allow reviews for delivered orders; the bot keeps a per-user set of delivered product IDs
+        await self.bot.load_json('orders') # Makes sure the order indexes are built
+        delivered_products = self.bot.cache.get('user_delivered_products', {}).get(interaction.user.id, frozenset())
+        user_has_purchased = product_id in delivered_products
         if not user_has_purchased:
             await interaction.followup.send("❌ You can only leave reviews for products you have successfully purchased and received. If this is an error, please contact staff.", ephemeral=True)
             return
@@ -588,14 +706,14 @@ class ProductManagement(commands.Cog):
         if not review_channel_id:
             await interaction.followup.send("⚠️ The review system is not configured correctly (review channel ID is missing in config). Please contact staff.", ephemeral=True); return
         
-        review_channel = self.bot.get_channel(review_channel_id)
-        if not review_channel or not isinstance(review_channel, discord.TextChannel):
+        review_channel = self.bot.get_config_channel("review_channel_id")
+        if not review_channel:
             await interaction.followup.send("⚠️ The configured review channel could not be found or is not a text channel. Please contact staff to fix this.", ephemeral=True); return
         
-        stars = "⭐" * rating.value # Generate star string
+        stars = _STARS[rating.value] # Generate star string
         review_embed = discord.Embed(
             title=f"New Review for {product.get('name', 'Unnamed Product')}", 
-            color=int(self.bot.config['embed_color'], 16), 
+            color=self.bot.embed_color_int, 
             timestamp=interaction.created_at
         )
         review_embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
@@ -626,14 +744,14 @@ class ProductManagement(commands.Cog):
         orders_data = await self.bot.load_json('orders') # Load orders data
         
         # Get points for the target user, default to 0 if not found
-        points = users_data.get(str(target_user.id), {}).get('points', 0)
+        points = users_data.get(target_user.id, {}).get('points', 0)
         
         # Count delivered orders for the target user
-        order_count = sum(1 for o in orders_data.values() if o.get('user_id') == target_user.id and o.get('status') == 'Delivered')
+        order_count = sum(1 for order_id in self._user_order_ids(target_user.id) if orders_data[order_id].get('status') == 'Delivered')
         
         embed = discord.Embed(
             title=f"🛍️ Store Profile: {target_user.display_name}", 
-            color=int(self.bot.config['embed_color'], 16),
+            color=self.bot.embed_color_int,
             timestamp=datetime.datetime.now(datetime.timezone.utc)
         )
         embed.set_author(name=target_user.display_name, icon_url=target_user.display_avatar.url)
@@ -650,7 +768,7 @@ class ProductManagement(commands.Cog):
         orders = await self.bot.load_json('orders') # Load orders data
         
         # Filter orders for the current user
-        user_orders = {oid: o for oid, o in orders.items() if o.get('user_id') == interaction.user.id}
+        user_orders = {oid: orders[oid] for oid in self._user_order_ids(interaction.user.id)}
         
         if not user_orders:
             await interaction.followup.send("You have no past orders recorded. Start shopping today!", ephemeral=True); return
@@ -658,28 +776,32 @@ class ProductManagement(commands.Cog):
         embed = discord.Embed(
             title="📜 Your Recent Order History", 
             description="Here are your most recent orders:", 
-            color=int(self.bot.config['embed_color'], 16),
+            color=self.bot.embed_color_int,
             timestamp=datetime.datetime.now(datetime.timezone.utc)
         )
         embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
 
-        # Sort orders by timestamp (newest first) and show up to 10
-        # Use .get('timestamp') with a fallback to a very old date string for safe sorting
-        sorted_orders = sorted(user_orders.items(), key=lambda item: item[1].get('timestamp', '1970-01-01T00:00:00+00:00'), reverse=True)[:10] 
+        # Pick the 10 newest orders by timestamp without sorting the user's whole history
+        # ISO timestamps compare correctly as strings; missing ones fall back to a very old date
+        sorted_orders = heapq.nlargest(10, user_orders.items(), key=lambda item: item[1].get('timestamp') or '1970-01-01T00:00:00+00:00')
         
         for order_id, order in sorted_orders:
             # Get item names, default to 'Unknown Product' if missing
             items_str = ", ".join(item.get('name', 'Unknown Product') for item in order.get('items', {}).values())
             
+            # The Discord timestamp string is cached per (order, timestamp), so repeat views skip the ISO parse
             order_time_str = order.get('timestamp')
-            order_date_display = "Date N/A"
-            if order_time_str:
-                try:
-                    # Convert ISO format string to datetime object, then to Discord timestamp format
-                    order_time = datetime.datetime.fromisoformat(order_time_str)
-                    order_date_display = f"<t:{int(order_time.timestamp())}:D>" # Short date format
-                except ValueError:
-                    print(f"Warning: Malformed timestamp for order {order_id}: {order_time_str}. Displaying as 'Date N/A'.")
+            order_date_display = self._order_date_display.get((order_id, order_time_str))
+            if order_date_display is None:
+                order_date_display = "Date N/A"
+                if order_time_str:
+                    try:
+                        # Convert ISO format string to datetime object, then to Discord timestamp format
+                        order_time = datetime.datetime.fromisoformat(order_time_str)
+                        order_date_display = f"<t:{int(order_time.timestamp())}:D>" # Short date format
+                    except ValueError:
+                        print(f"Warning: Malformed timestamp for order {order_id}: {order_time_str}. Displaying as 'Date N/A'.")
+                self._order_date_display[(order_id, order_time_str)] = order_date_display
             
             embed.add_field(
                 name=f"Order `#{order_id}` - {order_date_display}", 
@@ -7,15 +7,31 @@ from utils.checks import is_owner # Import our new owner check
 
 # Modified to use bot's save_json method
 async def update_config_value(bot: commands.Bot, key: str, value):
-    """Helper function to safely update a specific key in the bot's config and save it."""
+    """Helper function to safely update a specific key in the bot's config and schedule a save."""
+    await update_config_values(bot, {key: value})
+
+async def update_config_values(bot: commands.Bot, updates: dict):
+    """Applies several config keys at once and schedules a single save for all of them."""
     # Ensure the config is mutable if it's not already
     if not isinstance(bot.config, dict):
         bot.config = {} # Reinitialize if it's not a dict
     
-    bot.config[key] = value
-    # Save the entire config object
-    await bot.save_json('config', bot.config)
-    print(f"Config updated: {key} = {value}")
+    for key, value in updates.items():
+        bot.config[key] = value
+        if key.endswith('_channel_id'):
+            bot._channel_cache.pop(key, None) # Resolved again on next use by get_config_channel
+        if key == 'staff_role_ids':
+            bot.staff_role_ids_set = set(value) # Keep the membership set in sync with the stored list
+        if key == 'role_based_discounts':
+            bot.index_role_discounts() # Re-sort the cached discount tiers
+        if key == 'ticket_options':
+            bot.index_ticket_options() # Rebuild the category -> custom_id map
+            bot._ticket_options_version += 1 # Makes get_ticket_panel_view rebuild the buttons
+        if key in ('embed_color', 'success_color', 'error_color'):
+            setattr(bot, f"{key}_int", int(value, 16)) # Keep the pre-parsed colour in sync
+        print(f"Config updated: {key} = {value}")
+    # Writes are coalesced: a burst of updates saves the config once
+    bot.schedule_config_flush()
 
 
 # --- MODIFIED: Ticket Panel View now uses Buttons instead of a Dropdown ---
@@ -26,7 +42,7 @@ class TicketButton(discord.ui.Button):
             label=ticket_option.get("label", "Ticket"),
             emoji=ticket_option.get("emoji"),
             style=discord.ButtonStyle.secondary,
-            custom_id=f"ticket_cat_{ticket_option.get('category', 'general').lower()}" # Ensure custom_id is lowercase and safe
+            custom_id=bot.ticket_option_ids[ticket_option.get('category', 'general')] # Lowercased "ticket_cat_<category>", precomputed by bot.index_ticket_options
         )
         self.bot = bot
         self.ticket_type_info = ticket_option
@@ -63,6 +79,13 @@ class TicketPanelView(discord.ui.View):
             for opt in ticket_options:
                 self.add_item(TicketButton(bot=self.bot, ticket_option=opt))
 
+def get_ticket_panel_view(bot: commands.Bot) -> TicketPanelView:
+    """Returns the ticket panel view, rebuilding it only when ticket_options has changed."""
+    if bot._ticket_panel_view is None or bot._ticket_panel_view_version != bot._ticket_options_version:
+        bot._ticket_panel_view = TicketPanelView(bot=bot)
+        bot._ticket_panel_view_version = bot._ticket_options_version
+    return bot._ticket_panel_view
+
 class Setup(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
@@ -77,43 +100,43 @@ class Setup(commands.Cog):
                            renewal_alerts_channel: discord.TextChannel = None): # Optional: Allow setting renewal alerts channel
         await interaction.response.defer(ephemeral=True)
 
-        await update_config_value(self.bot, "ticket_panel_channel_id", panel_channel.id)
-        await update_config_value(self.bot, "ticket_transcripts_channel_id", transcripts_channel.id)
-        await update_config_value(self.bot, "points_log_channel_id", points_log_channel.id)
+        # All channel keys go into the config together, so they are saved in one write
+        await update_config_values(self.bot, {
+            "ticket_panel_channel_id": panel_channel.id,
+            "ticket_transcripts_channel_id": transcripts_channel.id,
+            "points_log_channel_id": points_log_channel.id,
+            "review_channel_id": review_channel.id if review_channel else None, # Clear if not provided
+            "renewal_alerts_channel_id": renewal_alerts_channel.id if renewal_alerts_channel else None, # Clear if not provided
+        })
         
         description = (
             f"**Ticket Panel Channel:** {panel_channel.mention}\n"
             f"**Transcripts Channel:** {transcripts_channel.mention}\n"
             f"**Points Log Channel:** {points_log_channel.mention}"
         )
-
         if review_channel:
-            await update_config_value(self.bot, "review_channel_id", review_channel.id)
             description += f"\n**Review Channel:** {review_channel.mention}"
-        else:
-            await update_config_value(self.bot, "review_channel_id", None) # Clear if not provided
-
         if renewal_alerts_channel:
-            await update_config_value(self.bot, "renewal_alerts_channel_id", renewal_alerts_channel.id)
             description += f"\n**Renewal Alerts Channel:** {renewal_alerts_channel.mention}"
-        else:
-            await update_config_value(self.bot, "renewal_alerts_channel_id", None) # Clear if not provided
 
-        embed = discord.Embed(title="✅ Channels Configured", description=description, color=int(self.bot.config['success_color'], 16))
+        await self.bot.flush_config() # Persist all channel updates in a single write before confirming
+
+        embed = discord.Embed(title="✅ Channels Configured", description=description, color=self.bot.success_color_int)
         await interaction.followup.send(embed=embed)
         
-        # After updating config, re-instantiate and add the TicketPanelView to bot if it exists
-        # This will refresh its buttons with the latest config.
-        # This is important if you later add new ticket types via config.json and want them to appear.
+        # Channel changes don't affect the panel buttons, so the TicketPanelView is only
+        # rebuilt and re-registered if ticket_options changed since the current one was built.
+        if self.bot._ticket_panel_view_version == self.bot._ticket_options_version:
+            return
         try:
-            # Remove old view instance if it exists and then add new one
-            existing_view = discord.utils.get(self.bot.persistent_views, custom_id="persistent_ticket_panel_view")
-            if existing_view:
-                self.bot.remove_view(existing_view)
-            
-            new_panel_view = TicketPanelView(bot=self.bot)
-            self.bot.add_view(new_panel_view)
-            print("Refreshed TicketPanelView after channel configuration.")
+            new_panel_view = get_ticket_panel_view(self.bot)
+            existing_view = self.bot._persistent_views_by_id.get("persistent_ticket_panel_view")
+            if existing_view is not new_panel_view:
+                # Remove old view instance if it exists and then add new one
+                if existing_view:
+                    self.bot.remove_view(existing_view)
+                self.bot.add_view(new_panel_view)
+                print("Refreshed TicketPanelView after channel configuration.")
         except Exception as e:
             print(f"Error refreshing TicketPanelView after channel configuration: {e}")
 
@@ -122,14 +145,9 @@ class Setup(commands.Cog):
     @is_owner()
     async def add_staff_role(self, interaction: discord.Interaction, role: discord.Role):
         await interaction.response.defer(ephemeral=True)
-        # Ensure staff_role_ids is a list in config
-        current_staff_roles = self.bot.config.get('staff_role_ids', [])
-        if not isinstance(current_staff_roles, list):
-            current_staff_roles = [] # Reset if not a list
-        
-        if role.id not in current_staff_roles:
-            current_staff_roles.append(role.id)
-            await update_config_value(self.bot, 'staff_role_ids', current_staff_roles)
+        if role.id not in self.bot.staff_role_ids_set:
+            # The set is the source of truth; the config keeps a sorted list for serialisation
+            await update_config_value(self.bot, 'staff_role_ids', sorted(self.bot.staff_role_ids_set | {role.id}))
             await interaction.followup.send(f"✅ Role {role.mention} has been added to the staff list.", ephemeral=True)
         else:
             await interaction.followup.send(f"❌ Role {role.mention} is already a staff role.", ephemeral=True)
@@ -138,13 +156,8 @@ class Setup(commands.Cog):
     @is_owner()
     async def remove_staff_role(self, interaction: discord.Interaction, role: discord.Role):
         await interaction.response.defer(ephemeral=True)
-        current_staff_roles = self.bot.config.get('staff_role_ids', [])
-        if not isinstance(current_staff_roles, list):
-            current_staff_roles = [] # Cannot remove if it's not a list
-
-        if role.id in current_staff_roles:
-            current_staff_roles.remove(role.id)
-            await update_config_value(self.bot, 'staff_role_ids', current_staff_roles)
+        if role.id in self.bot.staff_role_ids_set:
+            await update_config_value(self.bot, 'staff_role_ids', sorted(self.bot.staff_role_ids_set - {role.id}))
             await interaction.followup.send(f"✅ Role {role.mention} has been removed from the staff list.", ephemeral=True)
         else:
             await interaction.followup.send(f"❌ Role {role.mention} is not in the staff list.", ephemeral=True)
@@ -159,19 +172,19 @@ class Setup(commands.Cog):
             await interaction.followup.send("Error: Ticket panel channel not configured. Please run `/set_channels` first.", ephemeral=True)
             return
 
-        channel = self.bot.get_channel(channel_id)
-        if not channel or not isinstance(channel, discord.TextChannel):
+        channel = self.bot.get_config_channel("ticket_panel_channel_id")
+        if not channel:
             await interaction.followup.send(f"Error: Configured ticket panel channel (ID: {channel_id}) not found or is not a text channel. Please check the ID or run `/set_channels` again.", ephemeral=True)
             return
 
-        embed = discord.Embed(title="Support & Shopping Tickets", description="Welcome! Select an option below to open a ticket.", color=int(self.bot.config['embed_color'], 16))
+        embed = discord.Embed(title="Support & Shopping Tickets", description="Welcome! Select an option below to open a ticket.", color=self.bot.embed_color_int)
         
         ticket_panel_image_url = self.bot.config.get("ticket_panel_image_url")
         if ticket_panel_image_url:
             embed.set_image(url=ticket_panel_image_url) # Use image on the embed
 
-        # Re-initialize the view to ensure it has the latest ticket_options from config
-        view = TicketPanelView(bot=self.bot)
+        # Reuses the cached view unless ticket_options changed since it was built
+        view = get_ticket_panel_view(self.bot)
         
         try:
             await channel.send(embed=embed, view=view)
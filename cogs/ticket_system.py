@@ -5,13 +5,21 @@ import json
 import asyncio
 import os
 import chat_exporter
+import aiofiles
+import io
+import gzip
+import itertools
+import heapq
 import uuid
 import datetime
 from discord import app_commands
 import re 
 
+_UTC = datetime.timezone.utc # Bound once; every embed timestamp below uses it
+
 # Using the checks from utils
 from utils.checks import is_staff_or_owner
+from utils.text import THREAD_NAME_TABLE
 
 # A forward import is needed for type hinting without circular import errors
 from typing import TYPE_CHECKING
@@ -24,32 +32,33 @@ if TYPE_CHECKING:
 
 # --- UI View for Transcript Instructions ---
 class TranscriptInstructionsView(discord.ui.View):
+    # The instructions for each platform, shared by every instance
+    INSTRUCTIONS = {
+        "pc_mac": (
+            "**💻 How to View on PC / Mac**\n"
+            "1. Click the file above to download it.\n"
+            "2. Open your computer's 'Downloads' folder.\n"
+            "3. Double-click the file to open it in your web browser."
+        ),
+        "android": (
+            "**🤖 How to View on Android**\n"
+            "1. Tap the download icon on the file.\n"
+            "2. Open your phone's **'Files'** or **'My Files'** app.\n"
+            "3. Go to the 'Downloads' folder and tap the transcript file.\n"
+            "4. If prompted, choose a browser like **Chrome** to open it."
+        ),
+        "ios": (
+            "**🍎 How to View on iPhone / iPad**\n"
+            "1. Tap the file in the chat.\n"
+            "2. Tap the **Share icon** (box with an arrow) in the top-right corner.\n"
+            "3. Select **'Save to Files'** and choose a location.\n"
+            "4. Open the **'Files'** app on your device and tap the saved transcript to view it."
+        )
+    }
+
     def __init__(self):
         super().__init__(timeout=None) # Persists across restarts
         self.custom_id = "transcript_instructions_view" # Custom ID for persistence
-        # Pre-define the instructions for each platform
-        self.instructions = {
-            "pc_mac": (
-                "**💻 How to View on PC / Mac**\n"
-                "1. Click the file above to download it.\n"
-                "2. Open your computer's 'Downloads' folder.\n"
-                "3. Double-click the file to open it in your web browser."
-            ),
-            "android": (
-                "**🤖 How to View on Android**\n"
-                "1. Tap the download icon on the file.\n"
-                "2. Open your phone's **'Files'** or **'My Files'** app.\n"
-                "3. Go to the 'Downloads' folder and tap the transcript file.\n"
-                "4. If prompted, choose a browser like **Chrome** to open it."
-            ),
-            "ios": (
-                "**🍎 How to View on iPhone / iPad**\n"
-                "1. Tap the file in the chat.\n"
-                "2. Tap the **Share icon** (box with an arrow) in the top-right corner.\n"
-                "3. Select **'Save to Files'** and choose a location.\n"
-                "4. Open the **'Files'** app on your device and tap the saved transcript to view it."
-            )
-        }
 
     @discord.ui.select(
         custom_id="transcript_instructions_dropdown",
@@ -62,7 +71,30 @@ class TranscriptInstructionsView(discord.ui.View):
     )
     async def select_callback(self, interaction: discord.Interaction, select: discord.ui.Select):
         platform = select.values[0]
-        await interaction.response.send_message(self.instructions[platform], ephemeral=True)
+        await interaction.response.send_message(self.INSTRUCTIONS[platform], ephemeral=True)
+
+async def get_or_fetch_user(bot, user_id: int) -> discord.User:
+    """Returns a user from the gateway cache, then from bot._user_cache, and only then over REST (raises like fetch_user)."""
+    user = bot.get_user(user_id) or bot._user_cache.get(user_id)
+    if user is None:
+        user = await bot.fetch_user(user_id)
+        bot._user_cache[user_id] = user # Members who left the guild aren't in the gateway cache, so remember the REST result
+    return user
+
+def _get_transcript_view(bot) -> TranscriptInstructionsView:
+    """Returns the persistent TranscriptInstructionsView registered on the bot; it is stateless, so every send shares it."""
+    view = bot._persistent_views_by_id.get("transcript_instructions_view")
+    if view is None: # Views need a running loop, so the shared instance is created on first use if setup_hook didn't
+        view = TranscriptInstructionsView()
+        bot.add_view(view)
+    return view
+
+async def _write_transcript(filepath: str, data: bytes):
+    """Gzips an encoded transcript and writes it to disk without blocking the event loop."""
+    # HTML compresses 5-10x; only the archive is compressed, the uploads stay plain .html for easy viewing
+    compressed = await asyncio.to_thread(gzip.compress, data, compresslevel=6)
+    async with aiofiles.open(filepath, "wb") as f:
+        await f.write(compressed)
 
 # Helper function to close a ticket and generate transcript, usable by both staff and close button
 async def close_ticket_action(interaction: discord.Interaction, bot):
@@ -79,7 +111,7 @@ async def close_ticket_action(interaction: discord.Interaction, bot):
     ticket_creator = None
     if ticket_creator_id:
         try:
-            ticket_creator = await bot.fetch_user(ticket_creator_id)
+            ticket_creator = await get_or_fetch_user(bot, ticket_creator_id) # Cache first, REST only on a miss
         except discord.NotFound:
             print(f"Original ticket creator {ticket_creator_id} not found during transcript close.")
         except Exception as e:
@@ -94,11 +126,12 @@ async def close_ticket_action(interaction: discord.Interaction, bot):
             print(f"Transcript channel (ID: {transcript_channel_id}) not found or is not a text channel.")
             transcript_channel = None # Ensure it's None if invalid or not found
 
-    filepath = f"logs/transcripts/transcript-{interaction.channel.id}.html"
+    filepath = f"logs/transcripts/transcript-{interaction.channel.id}.html.gz"
     transcript_file_sent = False # Flag to track if transcript was successfully sent to staff
+    disk_task = None # Background write of the transcript file, awaited before the channel is deleted
 
     try:
-        os.makedirs('logs/transcripts', exist_ok=True) # Ensure directory exists
+        await asyncio.to_thread(os.makedirs, 'logs/transcripts', exist_ok=True) # Ensure directory exists
         
         # Export chat as HTML using chat_exporter
         transcript_html = await chat_exporter.export(
@@ -107,69 +140,84 @@ async def close_ticket_action(interaction: discord.Interaction, bot):
         )
         
         if transcript_html:
+            # Encode once: the same bytes are saved to disk (in the background) and attached to both messages
+            transcript_bytes = transcript_html.encode('utf-8')
+            del transcript_html # Only the encoded copy is needed from here on
+
             # Generate AI Summary if AI Chatbot cog is available
             ai_cog = bot.get_cog("AIChatbot")
             if ai_cog:
-                # Fetch history for summary. Limit to a reasonable number.
-                # History is fetched newest first, needs to be reversed for chronological order for LLM context.
-                history_for_summary = [msg async for msg in interaction.channel.history(limit=250)]
-                history_for_summary.reverse() 
-                summary = await ai_cog.generate_summary(history_for_summary)
+                # Fetch history for summary. The default of 100 fits in a single API page.
+                # History is fetched newest first (so the resolution is always included), then read back in chronological order.
+                history_limit = bot.config.get('ticket_summary_history_limit', 100)
+                history_for_summary = [msg async for msg in interaction.channel.history(limit=history_limit)]
+                summary = await ai_cog.generate_summary(reversed(history_for_summary)) # Iterate oldest first without reversing in place
                 
-                # Inject AI summary into the HTML transcript
-                # This is a basic string replacement, might need adjustment if chat_exporter's HTML structure changes
-                summary_html = f'<div style="background-color: #2b2d31; color: #ffffff; padding: 15px; margin: 10px 0; border-radius: 5px; border: 1px solid #404249;"><b>AI Summary:</b> {summary}</div>'
-                transcript_html = transcript_html.replace('<body>', f'<body>{summary_html}')
+                if summary: # Nothing to inject (and no copy to make) if the model returned an empty summary
+                    # Inject AI summary into the HTML transcript
+                    # This is a basic string replacement, might need adjustment if chat_exporter's HTML structure changes
+                    summary_html = f'<div style="background-color: #2b2d31; color: #ffffff; padding: 15px; margin: 10px 0; border-radius: 5px; border: 1px solid #404249;"><b>AI Summary:</b> {summary}</div>'
+                    # <body> sits near the top; splice the encoded summary in through memoryview slices so the
+                    # transcript is copied once by the join rather than once per slice
+                    body_idx = transcript_bytes.find(b'<body>')
+                    if body_idx != -1:
+                        body_idx += len(b'<body>')
+                        view = memoryview(transcript_bytes)
+                        transcript_bytes = b''.join((view[:body_idx], summary_html.encode('utf-8'), view[body_idx:]))
+                        view.release()
             else:
                 print("AIChatbot cog not found, skipping AI summary generation.")
 
-            # Save the HTML to a file
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(transcript_html)
+            disk_task = asyncio.create_task(_write_transcript(filepath, transcript_bytes))
 
-            # Send transcript to staff channel
-            if transcript_channel:
-                try:
-                    staff_embed = discord.Embed(
-                        title="Ticket Transcript Saved",
-                        description=f"Ticket `{interaction.channel.name}` (ID: {interaction.channel.id}) closed by {interaction.user.mention}.",
-                        color=int(bot.config['error_color'], 16), # Using error_color for closed ticket log
-                        timestamp=datetime.datetime.now(datetime.timezone.utc)
-                    )
-                    staff_file = discord.File(filepath, filename=f"transcript-{interaction.channel.id}.html")
-                    await transcript_channel.send(embed=staff_embed, file=staff_file, view=TranscriptInstructionsView())
-                    transcript_file_sent = True
-                    print(f"Transcript sent to staff channel for ticket {interaction.channel.id}.")
-                except discord.Forbidden:
-                    print(f"Bot lacks permissions to send transcript to staff channel {transcript_channel_id}.")
-                    await interaction.followup.send("⚠️ Transcript generated but could not be sent to staff channel (permissions error).", ephemeral=True)
-                except Exception as e:
-                    print(f"Error sending transcript to staff channel: {type(e).__name__}: {e}")
-                    await interaction.followup.send("⚠️ Transcript generated but an error occurred sending to staff channel.", ephemeral=True)
-            else:
-                await interaction.followup.send("⚠️ Transcript channel not configured or found. Transcript generated but not sent to staff.", ephemeral=True)
+            closed_at = datetime.datetime.now(_UTC) # One timestamp shared by the staff log and the customer DM
 
+            # Both uploads go out concurrently; each helper reports its own failures to the user
+            async def _send_staff() -> bool:
+                if transcript_channel:
+                    try:
+                        staff_embed = discord.Embed(
+                            title="Ticket Transcript Saved",
+                            description=f"Ticket `{interaction.channel.name}` (ID: {interaction.channel.id}) closed by {interaction.user.mention}.",
+                            color=bot.error_color_int, # Using error_color for closed ticket log
+                            timestamp=closed_at
+                        )
+                        staff_file = discord.File(io.BytesIO(transcript_bytes), filename=f"transcript-{interaction.channel.id}.html")
+                        await transcript_channel.send(embed=staff_embed, file=staff_file, view=_get_transcript_view(bot))
+                        print(f"Transcript sent to staff channel for ticket {interaction.channel.id}.")
+                        return True
+                    except discord.Forbidden:
+                        print(f"Bot lacks permissions to send transcript to staff channel {transcript_channel_id}.")
+                        await interaction.followup.send("⚠️ Transcript generated but could not be sent to staff channel (permissions error).", ephemeral=True)
+                    except Exception as e:
+                        print(f"Error sending transcript to staff channel: {type(e).__name__}: {e}")
+                        await interaction.followup.send("⚠️ Transcript generated but an error occurred sending to staff channel.", ephemeral=True)
+                else:
+                    await interaction.followup.send("⚠️ Transcript channel not configured or found. Transcript generated but not sent to staff.", ephemeral=True)
+                return False
 
-            # Send transcript to ticket creator via DM
-            if ticket_creator:
-                try:
-                    customer_embed = discord.Embed(
-                        title="Your Ticket Has Been Closed",
-                        description="Thank you for contacting us. A transcript of your conversation is attached for your reference.",
-                        color=int(bot.config['embed_color'], 16), # Using embed_color for customer DM
-                        timestamp=datetime.datetime.now(datetime.timezone.utc)
-                    )
-                    customer_file = discord.File(filepath, filename=f"transcript-{interaction.channel.id}.html")
-                    await ticket_creator.send(embed=customer_embed, file=customer_file, view=TranscriptInstructionsView())
-                    print(f"Transcript DM sent to ticket creator {ticket_creator.id}.")
-                except discord.Forbidden:
-                    await interaction.followup.send(f"⚠️ Could not send transcript DM to `{ticket_creator.display_name}` (DMs disabled).", ephemeral=True)
-                    print(f"Could not send transcript DM to {ticket_creator.id}: DMs disabled.")
-                except Exception as e:
-                    await interaction.followup.send("⚠️ Transcript generated but an error occurred sending DM to you.", ephemeral=True)
-                    print(f"Error sending customer transcript DM to {ticket_creator.id}: {type(e).__name__}: {e}")
-            else:
-                await interaction.followup.send("⚠️ Could not identify the original ticket creator to send a transcript DM.", ephemeral=True)
+            async def _send_creator():
+                if ticket_creator:
+                    try:
+                        customer_embed = discord.Embed(
+                            title="Your Ticket Has Been Closed",
+                            description="Thank you for contacting us. A transcript of your conversation is attached for your reference.",
+                            color=bot.embed_color_int, # Using embed_color for customer DM
+                            timestamp=closed_at
+                        )
+                        customer_file = discord.File(io.BytesIO(transcript_bytes), filename=f"transcript-{interaction.channel.id}.html")
+                        await ticket_creator.send(embed=customer_embed, file=customer_file, view=_get_transcript_view(bot))
+                        print(f"Transcript DM sent to ticket creator {ticket_creator.id}.")
+                    except discord.Forbidden:
+                        await interaction.followup.send(f"⚠️ Could not send transcript DM to `{ticket_creator.display_name}` (DMs disabled).", ephemeral=True)
+                        print(f"Could not send transcript DM to {ticket_creator.id}: DMs disabled.")
+                    except Exception as e:
+                        await interaction.followup.send("⚠️ Transcript generated but an error occurred sending DM to you.", ephemeral=True)
+                        print(f"Error sending customer transcript DM to {ticket_creator.id}: {type(e).__name__}: {e}")
+                else:
+                    await interaction.followup.send("⚠️ Could not identify the original ticket creator to send a transcript DM.", ephemeral=True)
+
+            transcript_file_sent, _ = await asyncio.gather(_send_staff(), _send_creator())
 
         else: # If transcript_html is empty (e.g., no messages in thread)
             await interaction.followup.send("❌ Failed to generate transcript (no messages in ticket or export failed).", ephemeral=True)
@@ -190,7 +238,15 @@ async def close_ticket_action(interaction: discord.Interaction, bot):
                 print(f"Bot lacks permissions to send critical error message to staff channel {transcript_channel_id}.")
     finally:
         # Always clean up active_tickets and delete channel after attempts, even if transcript failed
+        if disk_task:
+            try:
+                await disk_task
+            except Exception as e:
+                print(f"Error saving transcript file {filepath}: {type(e).__name__}: {e}")
+        if (rename_task := ticket_state.get('_rename_task')):
+            rename_task.cancel() # The thread is about to be deleted
         bot.active_tickets.pop(interaction.channel.id, None)
+        bot.discard_ticket_events(interaction.channel.id)
         print(f"Removed ticket {interaction.channel.id} from active_tickets cache.")
         
         # Give a moment for messages to send before deleting the channel
@@ -209,35 +265,73 @@ async def close_ticket_action(interaction: discord.Interaction, bot):
             await interaction.followup.send(f"❌ An unexpected error occurred while deleting the ticket channel: {type(e).__name__}: {e}", ephemeral=True)
 
 
+# Redeem codes are recorded in discount_reason as "Discount Code (REDEEM-XXXXXX)"
+_REDEEM_CODE_PREFIX = "REDEEM-"
+_REDEEM_CODE_RE = re.compile(r'\(([^)]+)\)')
+
 # --- UI COMPONENTS FOR BUY TICKETS ---
+def _cart_total(ticket_state: dict) -> float:
+    """Returns the ticket's running cart total, re-summing the cart only if it was never tracked."""
+    total = ticket_state.get('cart_total')
+    if total is None:
+        # Tickets restored from older state have no running total, so build it once from the cart
+        total = sum((i.get('price') or 0.0) * i.get('quantity', 0) for i in ticket_state.get('cart', {}).values())
+        ticket_state['cart_total'] = total
+    return total
+
+def _cart_line(item_data: dict) -> str:
+    """Formats one cart item as a line of the cart embed."""
+    quantity = item_data.get('quantity', 0)
+    item_total = (item_data.get('price') or 0.0) * quantity
+    return f"**{item_data.get('name', 'Unknown Product')}** x{quantity} - `₹{item_total:.2f}`"
+
+async def _rename_after_delay(channel: discord.Thread, new_name: str, delay: float):
+    """Renames a ticket thread after `delay` seconds unless a newer rename cancels this one first."""
+    await asyncio.sleep(delay)
+    # To avoid hitting rate limits, only edit if the name is different
+    if channel.name == new_name:
+        return
+    try:
+        await channel.edit(name=new_name)
+    except Exception as e:
+        print(f"Could not rename thread {channel.id}: {type(e).__name__}: {e}") # Log error but don't stop the flow
+
+def _product_select_options(products: dict):
+    """Yields a SelectOption for each product with stock > 0 or infinite stock (-1)."""
+    SelectOption = discord.SelectOption # Local binding; this runs once per product
+    for pid, prod in products.items():
+        try:
+            stock = int(prod.get('stock', 0)) # Explicitly convert stock to int here
+        except ValueError:
+            print(f"Warning: Product {pid} has non-integer stock '{prod.get('stock')}'. Skipping for ProductSelect.")
+            continue # Skip this product if stock is not a valid integer
+
+        if stock > 0 or stock == -1:
+            price = prod.get('price')
+            yield SelectOption(
+                label=prod.get('name', 'Unnamed Product')[:100], # Truncate label to 100 characters for Discord limit
+                value=pid, 
+                description=f"Price: ₹{price:.2f}" if price is not None else "Custom Quote", 
+                emoji=prod.get('emoji') # Custom emoji directly from config/product data
+            )
+
 class ProductSelect(discord.ui.Select):
     def __init__(self, bot, products): # products passed from ShoppingCartView init
         self.bot = bot
-        # Only show products that have stock > 0 or are infinite (-1)
-        # Ensure 'name', 'price', 'emoji' keys exist with defaults
-        options = []
-        for pid, prod in products.items():
-            try:
-                stock = int(prod.get('stock', 0)) # Explicitly convert stock to int here
-            except ValueError:
-                print(f"Warning: Product {pid} has non-integer stock '{prod.get('stock')}'. Skipping for ProductSelect.")
-                continue # Skip this product if stock is not a valid integer
-
-            if stock > 0 or stock == -1:
-                options.append(
-                    discord.SelectOption(
-                        label=prod.get('name', 'Unnamed Product')[:100], # Truncate label to 100 characters for Discord limit
-                        value=pid, 
-                        description=f"Price: ₹{prod.get('price', 0.0):.2f}" if prod.get('price') is not None else "Custom Quote", 
-                        emoji=prod.get('emoji') # Custom emoji directly from config/product data
-                    )
-                )
-        
-        options = options[:25] # Limit to 25 options per Discord's API limits for select menus
+        super().__init__(placeholder="Select a product to add to your cart...", options=self._build_options(products), custom_id="product_select")
 
+    @staticmethod
+    def _build_options(products: dict) -> list:
+        """Options for the sellable products, or a single disabled placeholder when there are none."""
+        # Only the first 25 sellable products fit in a select menu, so stop generating options there
+        options = list(itertools.islice(_product_select_options(products), 25))
         if not options:
             options.append(discord.SelectOption(label="No products available at the moment.", value="disabled", emoji="❌"))
-        super().__init__(placeholder="Select a product to add to your cart...", options=options, custom_id="product_select")
+        return options
+
+    def set_products(self, products: dict):
+        """Replaces the dropdown's options in place; the select stays attached to its view."""
+        self.options = self._build_options(products)
 
     async def callback(self, interaction: discord.Interaction):
         if self.values[0] == "disabled":
@@ -246,7 +340,10 @@ class ProductSelect(discord.ui.Select):
         
         # Defer immediately as this can involve multiple async operations and message edits
         await interaction.response.defer(thinking=True, ephemeral=True) 
-        
+        async with _ticket_lock(self.bot, interaction.channel.id): # Cart changes can't land mid-confirm
+            await self._add_to_cart(interaction)
+
+    async def _add_to_cart(self, interaction: discord.Interaction):
         ticket_state = self.bot.active_tickets.get(interaction.channel.id)
         if not ticket_state:
             await interaction.followup.send("❌ This ticket is no longer active. Please open a new one if needed.", ephemeral=True)
@@ -274,14 +371,17 @@ class ProductSelect(discord.ui.Select):
                 await interaction.followup.send(f"⚠️ You cannot add more of **{product['name']}**. All available stock is already in your cart.", ephemeral=True)
                 return
 
+        running_total = _cart_total(ticket_state) # Total before this item is added
         if product_id in cart: 
             cart[product_id]['quantity'] += 1
         else: 
-            # Ensure price exists for new items, default to 0.0 if not set in product
-            cart[product_id] = {"name": product['name'], "price": product.get('price', 0.0), "quantity": 1}
+            # Cart items always carry a float price; Custom Quote products (NULL price) go in at 0.0
+            cart[product_id] = {"name": product['name'], "price": product.get('price') or 0.0, "quantity": 1}
         
         ticket_state["cart"] = cart
-        self.bot.active_tickets[interaction.channel.id] = ticket_state # Update active_tickets in memory
+        # Keep the running total in step with the cart so the embed never re-sums it
+        ticket_state['cart_total'] = running_total + (cart[product_id].get('price') or 0.0)
+        self.bot.append_ticket_event(interaction.channel.id, {"event": "cart", "cart": cart, "cart_total": ticket_state['cart_total']})
 
         # Dynamic Ticket Renaming Logic (only for private threads)
         if isinstance(interaction.channel, discord.Thread) and interaction.channel.type == discord.ChannelType.private_thread:
@@ -290,7 +390,7 @@ class ProductSelect(discord.ui.Select):
                 # Use .get() with a default to prevent KeyError if 'name' is missing
                 first_item_name = next(iter(cart.values())).get('name', 'Product')
                 # Sanitize name for Discord channel naming (alphanumeric, hyphens only, no special chars)
-                sanitized_name = re.sub(r'[^a-zA-Z0-9-]', '', first_item_name).strip()
+                sanitized_name = first_item_name.translate(THREAD_NAME_TABLE).strip()
                 if not sanitized_name: 
                     sanitized_name = "product" # Fallback if name becomes empty after sanitization
                 
@@ -303,14 +403,15 @@ class ProductSelect(discord.ui.Select):
                 new_name = f"{base_info}{item_part}-x{cart[product_id]['quantity']}"
                 new_name = new_name[:100].strip('- ') # Final truncation and cleanup, remove trailing hyphens/spaces
                 
-                # To avoid hitting rate limits, only edit if the name is different
-                if interaction.channel.name != new_name:
-                    await interaction.channel.edit(name=new_name)
+                # Thread renames are heavily rate limited, so a burst of adds collapses into one delayed rename
+                if (rename_task := ticket_state.get('_rename_task')):
+                    rename_task.cancel()
+                ticket_state['_rename_task'] = asyncio.create_task(_rename_after_delay(interaction.channel, new_name, 2.0))
             except Exception as e:
                 print(f"Could not rename thread {interaction.channel.id}: {type(e).__name__}: {e}") # Log error but don't stop the flow
 
         # Update the cart embed in the thread.
-        # Use the stored cart_message_id from ticket_state if available, otherwise try to find it.
+        # cart_message_id is stored when the cart message is posted, so there is no need to search history for it.
         cart_message_id = ticket_state.get('cart_message_id')
         cart_message = None
         if cart_message_id:
@@ -318,23 +419,25 @@ class ProductSelect(discord.ui.Select):
                 cart_message = await interaction.channel.fetch_message(cart_message_id)
             except discord.NotFound:
                 print(f"Cart message {cart_message_id} not found in channel {interaction.channel.id} (might be deleted).")
-                cart_message_id = None # Invalidate ID if message not found
             except Exception as e:
+                # Transient failures (5xx, rate limits) don't mean the message is gone; re-posting would leave two carts
                 print(f"Error fetching cart message {cart_message_id}: {type(e).__name__}: {e}")
-                cart_message_id = None
-        
-        # If message not found by ID or ID was stale, try to find it in recent history
+                await interaction.followup.send(f"⚠️ Added **{product['name']}** to your cart, but the cart message could not be refreshed right now. It will update on your next change.", ephemeral=True)
+                return
+        else:
+            print(f"Warning: No cart_message_id stored for ticket {interaction.channel.id}.")
+
+        # If the cart message is missing or was deleted, post a fresh one (update_cart_embed fills it in) and remember its ID
         if not cart_message:
-            # Look for recent bot messages with components (likely the cart message)
-            messages_history = [msg async for msg in interaction.channel.history(limit=50) if msg.author == self.bot.user and msg.components]
-            for msg in messages_history:
-                # Check if the message has components belonging to a ShoppingCartView
-                if any(isinstance(comp, discord.ui.Item) and comp.custom_id in ["product_select", "cart_confirm", "cart_discount", "cart_cancel"] 
-                       for row in msg.components for comp in row.children): # Iterate through component rows and children
-                    cart_message = msg
-                    ticket_state['cart_message_id'] = cart_message.id # Store newly found message ID
-                    self.bot.active_tickets[interaction.channel.id] = ticket_state # Update active_tickets
-                    break
+            try:
+                cart_message = await interaction.channel.send(
+                    embed=discord.Embed(title="🛒 Your Shopping Cart", color=self.bot.embed_color_int),
+                    view=self.view
+                )
+                ticket_state['cart_message_id'] = cart_message.id
+                self.bot.append_ticket_event(interaction.channel.id, {"event": "cart_message", "cart_message_id": cart_message.id})
+            except Exception as e:
+                print(f"Error re-posting cart message in channel {interaction.channel.id}: {type(e).__name__}: {e}")
 
         if cart_message:
             # Call update_cart_embed on the main ShoppingCartView instance (self.view)
@@ -345,6 +448,22 @@ class ProductSelect(discord.ui.Select):
             await interaction.followup.send("✅ Added product to cart, but could not find the main cart message to update visually. Please check the ticket for the updated cart total.", ephemeral=True)
 
 
+def _ticket_lock(bot, channel_id: int) -> asyncio.Lock:
+    """Returns the lock serializing cart actions on one ticket; kept in ticket_state as a runtime-only '_' key."""
+    ticket_state = bot.active_tickets.get(channel_id)
+    if ticket_state is None:
+        return asyncio.Lock() # No state to guard; the handler reports the lost ticket itself
+    return ticket_state.setdefault('_lock', asyncio.Lock())
+
+def _get_shopping_cart_view(bot) -> "ShoppingCartView":
+    """Returns the persistent ShoppingCartView registered on the bot, registering one if setup_hook didn't."""
+    view = bot._persistent_views_by_id.get("persistent_shopping_cart_view")
+    if view is None:
+        print("Warning: Persistent ShoppingCartView not found. Registering a new one for cart updates.")
+        view = ShoppingCartView(bot, {}) # update_cart_embed fills the dropdown on first render
+        bot.add_view(view)
+    return view
+
 class DiscountCodeModal(discord.ui.Modal, title="Apply Discount Code"):
     def __init__(self, bot, channel_id: int): # Pass bot and channel_id instead of ShoppingCartView for cleaner modal
         super().__init__()
@@ -360,6 +479,10 @@ class DiscountCodeModal(discord.ui.Modal, title="Apply Discount Code"):
 
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True) # Defer immediately for modal submission
+        async with _ticket_lock(self.bot, self.channel_id): # Serialized with confirm/cancel on the same ticket
+            await self._apply_code(interaction)
+
+    async def _apply_code(self, interaction: discord.Interaction):
         code = self.code_input.value.strip().upper()
         
         ticket_state = self.bot.active_tickets.get(self.channel_id)
@@ -392,8 +515,9 @@ class DiscountCodeModal(discord.ui.Modal, title="Apply Discount Code"):
                 return
 
             # Check if user is a new customer (no prior delivered orders)
-            orders = await self.bot.load_json('orders') # Using bot's load_json
-            has_past_orders = any(o.get('user_id') == interaction.user.id and o.get('status') == 'Delivered' for o in orders.values())
+            # Every user with a delivered order has an entry in the delivered products index
+            await self.bot.load_json('orders') # Makes sure the order indexes are built
+            has_past_orders = interaction.user.id in self.bot.cache.get('user_delivered_products', {})
             if has_past_orders:
                 await interaction.followup.send("❌ Referral codes are for **new customers only** (users without prior delivered orders).", ephemeral=True)
                 return
@@ -413,31 +537,21 @@ class DiscountCodeModal(discord.ui.Modal, title="Apply Discount Code"):
             ticket_state['discount'] = discount_amount
             ticket_state['discount_reason'] = f"Referral Discount (Code: {code})" # Store reason for transparency
             ticket_state['referral_info'] = {"code": code, "referrer_id": referrer_id} # Store referral details
-            self.bot.active_tickets[self.channel_id] = ticket_state # Update active_tickets in memory
+            self.bot.append_ticket_event(interaction.channel.id, {
+                "event": "discount", "discount": discount_amount,
+                "discount_reason": ticket_state['discount_reason'], "referral_info": ticket_state['referral_info']
+            })
 
             await interaction.followup.send(f"✅ Success! A new customer discount of **₹{discount_amount:.2f}** has been applied to your order.", ephemeral=True)
             
             # Now, find the ShoppingCartView message in the channel and update its embed
-            # Use the stored cart_message_id if available, or try to find it
+            # The stored ID is enough to edit the message; update_cart_embed handles it having been deleted
             cart_message_id = ticket_state.get('cart_message_id')
-            cart_message = None
-            if cart_message_id:
-                try:
-                    cart_message = await interaction.channel.fetch_message(cart_message_id)
-                except discord.NotFound:
-                    print(f"Cart message {cart_message_id} not found for update after discount modal.")
+            cart_message = interaction.channel.get_partial_message(cart_message_id) if cart_message_id else None
             
             if cart_message:
-                # To call update_cart_embed, we need an instance of ShoppingCartView.
-                # Since the view is persistent, we can try to get its instance from bot.persistent_views.
-                # If not found (e.g., bot restarted or view not added persistently), create a dummy one.
-                sc_view_instance = discord.utils.get(self.bot.persistent_views, custom_id="persistent_shopping_cart_view")
-                if not sc_view_instance:
-                    print("Warning: Persistent ShoppingCartView not found. Creating dummy for update.")
-                    dummy_products_for_view = await self.bot.load_json('products') # Pass products for ProductSelect options
-                    sc_view_instance = ShoppingCartView(self.bot, dummy_products_for_view)
-                
-                await sc_view_instance.update_cart_embed(interaction=interaction, message_to_edit=cart_message)
+                # To call update_cart_embed, we need an instance of ShoppingCartView; the persistent one is shared
+                await _get_shopping_cart_view(self.bot).update_cart_embed(interaction=interaction, message_to_edit=cart_message)
             else:
                 await interaction.followup.send("⚠️ Applied discount, but could not find the main cart message to update visually. Please check the ticket for the updated cart total.", ephemeral=True)
             return
@@ -477,7 +591,7 @@ class DiscountCodeModal(discord.ui.Modal, title="Apply Discount Code"):
             if expiry_str := discount_info.get("expires_at"):
                 try:
                     expiry_time = datetime.datetime.fromisoformat(expiry_str)
-                    if expiry_time < datetime.datetime.now(datetime.timezone.utc):
+                    if expiry_time < datetime.datetime.now(_UTC):
                         await interaction.followup.send("❌ This promotional code has expired.", ephemeral=True)
                         return
                 except ValueError:
@@ -501,31 +615,19 @@ class DiscountCodeModal(discord.ui.Modal, title="Apply Discount Code"):
         # Apply the discount to the current ticket state
         ticket_state['discount'] = discount_amount
         ticket_state['discount_reason'] = f"Discount Code ({code})" # Store reason
-        self.bot.active_tickets[self.channel_id] = ticket_state
+        self.bot.append_ticket_event(interaction.channel.id, {"event": "discount", "discount": discount_amount, "discount_reason": ticket_state['discount_reason']})
         
         await self.bot.save_json('discounts', discounts_db) # Save updated discounts data
         
         await interaction.followup.send(f"✅ Success! A discount of **₹{discount_amount:.2f}** has been applied to your order.", ephemeral=True)
         
         # Now, find the ShoppingCartView message in the channel and update its embed
-        # Use the stored cart_message_id if available, or try to find it
+        # The stored ID is enough to edit the message; update_cart_embed handles it having been deleted
         cart_message_id = ticket_state.get('cart_message_id')
-        cart_message = None
-        if cart_message_id:
-            try:
-                cart_message = await interaction.channel.fetch_message(cart_message_id)
-            except discord.NotFound:
-                print(f"Cart message {cart_message_id} not found for update after discount modal.")
+        cart_message = interaction.channel.get_partial_message(cart_message_id) if cart_message_id else None
         
         if cart_message:
-            # Get the persistent view instance or create a dummy for updating
-            sc_view_instance = discord.utils.get(self.bot.persistent_views, custom_id="persistent_shopping_cart_view")
-            if not sc_view_instance:
-                print("Warning: Persistent ShoppingCartView not found. Creating dummy for update after discount.")
-                dummy_products_for_view = await self.bot.load_json('products')
-                sc_view_instance = ShoppingCartView(self.bot, dummy_products_for_view)
-            
-            await sc_view_instance.update_cart_embed(interaction=interaction, message_to_edit=cart_message)
+            await _get_shopping_cart_view(self.bot).update_cart_embed(interaction=interaction, message_to_edit=cart_message)
         else:
             await interaction.followup.send("⚠️ Applied discount, but could not find the main cart message to update visually. Please check the ticket for the updated cart total.", ephemeral=True)
 
@@ -535,13 +637,16 @@ class ShoppingCartView(discord.ui.View):
         super().__init__(timeout=None) # Persists across restarts
         self.bot = bot
         self.custom_id = "persistent_shopping_cart_view" # Custom ID for persistence\
-        self.add_item(ProductSelect(bot, products))
+        self.product_select = ProductSelect(bot, products) # View.children is a copy, so keep our own handle
+        self.add_item(self.product_select)
+        self._products_revision = None # data_revisions['products'] the dropdown was last built from
 
-    async def update_cart_embed(self, interaction: discord.Interaction, message_to_edit: discord.Message = None):
+    async def update_cart_embed(self, interaction: discord.Interaction, message_to_edit: discord.Message = None, disable_items: bool = False):
         """
         Updates the shopping cart embed with the current cart contents and total.
         This function is crucial for keeping the UI in sync with the bot's state.
         It must be called reliably after any cart modification.
+        With disable_items, the view's components are disabled in the same edit.
         """
         ticket_state = self.bot.active_tickets.get(interaction.channel.id)
         if not ticket_state:
@@ -553,44 +658,54 @@ class ShoppingCartView(discord.ui.View):
         cart = ticket_state.get("cart", {})
         discount = ticket_state.get("discount", 0.0)
         discount_reason = ticket_state.get('discount_reason', 'Discount Applied') # Get the reason for the discount
-        embed = discord.Embed(
-            title="🛒 Your Shopping Cart", 
-            color=int(self.bot.config['embed_color'], 16),
-            timestamp=datetime.datetime.now(datetime.timezone.utc) # Add timestamp for freshness
-        )
+        # One embed per ticket, reused across renders; the view is shared by every ticket, so it can't hold it
+        embed = ticket_state.get('_cart_embed')
+        if embed is None:
+            embed = ticket_state['_cart_embed'] = discord.Embed(title="🛒 Your Shopping Cart", color=self.bot.embed_color_int)
+        embed.timestamp = datetime.datetime.now(_UTC) # Add timestamp for freshness
         
         if not cart:
             embed.description = "Your cart is empty. Select a product from the dropdown to begin."
             embed.set_footer(text="Grand Total: ₹0.00")
         else:
-            total = sum(i.get('price', 0.0) * i.get('quantity', 0) for i in cart.values()) # Ensure price is float
-            description_lines = []
-            for product_id, item_data in cart.items():
-                product_name = item_data.get('name', 'Unknown Product')
-                quantity = item_data.get('quantity', 0)
-                price_per_unit = item_data.get('price', 0.0)
-                item_total = price_per_unit * quantity
-                description_lines.append(f"**{product_name}** x{quantity} - `₹{item_total:.2f}`")
-            
-            description = "\n".join(description_lines)
-            
-            if discount > 0.0:
-                description += f"\n\n**{discount_reason}:** `-₹{discount:.2f}`"
-            
-            embed.description = description
+            total = _cart_total(ticket_state)
+            description = "\n".join(_cart_line(item_data) for item_data in cart.values())
+            discount_suffix = f"\n\n**{discount_reason}:** `-₹{discount:.2f}`" if discount > 0.0 else ""
+            embed.description = description + discount_suffix
             final_total = max(0.0, total - discount) # Ensure final total is not negative
             embed.set_footer(text=f"Grand Total: ₹{final_total:.2f}")
 
-        # Always re-render the ProductSelect dropdown options with fresh data
-        current_products_for_view = await self.bot.load_json('products')
-        self.children[0] = ProductSelect(self.bot, current_products_for_view) # Re-assigns the ProductSelect instance
+        # The dropdown only depends on the products dataset, so rebuild it only after products were saved
+        products_revision = self.bot.data_revisions.get('products', 0)
+        if products_revision != self._products_revision:
+            current_products_for_view = await self.bot.load_json('products')
+            self.product_select.set_products(current_products_for_view) # Refresh the options of the existing select
+            self._products_revision = products_revision
+
+        # The view is one instance shared by every ticket, so set the state for this render either way;
+        # otherwise one confirmed ticket would leave every other ticket's cart disabled
+        for item in self.children: # Includes the product dropdown
+            item.disabled = disable_items
 
         # Ensure the view is always updated on the original message.
         # This is the most crucial part for button interactions to work correctly.
+        if message_to_edit is None and (cart_message_id := ticket_state.get('cart_message_id')):
+            message_to_edit = interaction.channel.get_partial_message(cart_message_id) # Edit by ID without fetching first
+
         if message_to_edit:
+            # Everything the edit would change, including the component state the shared view is in right now;
+            # an identical render (e.g. a cart re-render with no new discount) skips the PATCH
+            render_hash = hash((
+                tuple((pid, item_data.get('quantity', 0)) for pid, item_data in sorted(cart.items())),
+                discount, discount_reason, products_revision,
+                tuple(item.disabled for item in self.children), message_to_edit.id
+            ))
+            if ticket_state.get('_last_render_hash') == render_hash:
+                return
             try:
                 # Removed 'attachments=[file_for_embed]' as it's not always defined here.
                 await message_to_edit.edit(embed=embed, view=self) 
+                ticket_state['_last_render_hash'] = render_hash
                 print(f"Cart message {message_to_edit.id} updated successfully.")
             except discord.NotFound:
                 print(f"Error: Cart message {message_to_edit.id} not found during edit. It might have been deleted. Sending ephemeral followup.")
@@ -612,13 +727,20 @@ class ShoppingCartView(discord.ui.View):
 
     @discord.ui.button(label="Confirm Order", style=discord.ButtonStyle.primary, emoji="<:ib_yes:1393834020470521876>", custom_id="cart_confirm", row=1)
     async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=False) # Defer publicly as this is a major action
+        async with _ticket_lock(self.bot, interaction.channel.id): # A double click waits here instead of racing the first
+            await self._confirm_order(interaction)
+
+    async def _confirm_order(self, interaction: discord.Interaction):
         try:
-            await interaction.response.defer(ephemeral=False) # Defer publicly as this is a major action
             ticket_state = self.bot.active_tickets.get(interaction.channel.id)
             
             if not ticket_state or not ticket_state.get("cart"):
                 await interaction.followup.send("Your cart is empty. Cannot confirm an empty order. Please add products first.", ephemeral=True)
                 return
+            if ticket_state.get('order_id'):
+                await interaction.followup.send(f"This order has already been confirmed as `#{ticket_state['order_id']}`.", ephemeral=True)
+                return
                 
             cart_contents = ticket_state.get("cart", {})
             if not cart_contents: # Double-check cart is not empty
@@ -626,21 +748,20 @@ class ShoppingCartView(discord.ui.View):
                 return
 
             # Check product stock before confirming order, prevent overselling
-            products_db = await self.bot.load_json('products')
+            product_index = await self.bot.get_product_index() # Stock is already int-converted per product
+            product_names, product_stock = product_index['name'], product_index['stock']
             for pid, item_data in cart_contents.items():
-                product_info = products_db.get(pid)
-                if not product_info:
+                if pid not in product_names:
                     await interaction.followup.send(f"❌ Product '{item_data.get('name', pid)}' not found in store. Cannot confirm order. Please remove it from your cart.", ephemeral=True)
                     return
-                try:
-                    stock_available = int(product_info.get('stock', 0)) # Ensure stock is int
-                except ValueError:
-                    await interaction.followup.send(f"❌ Product '{product_info.get('name', pid)}' has invalid stock data. Please contact staff.", ephemeral=True)
+                stock_available = product_stock[pid]
+                if stock_available is None:
+                    await interaction.followup.send(f"❌ Product '{product_names[pid]}' has invalid stock data. Please contact staff.", ephemeral=True)
                     return
 
                 quantity_in_cart = item_data.get('quantity', 0)
                 if stock_available != -1 and quantity_in_cart > stock_available: # -1 is infinite
-                    await interaction.followup.send(f"❌ We only have {stock_available} of '{product_info.get('name', pid)}' in stock, but your cart has {quantity_in_cart}. Please adjust the quantity in your cart.", ephemeral=True)
+                    await interaction.followup.send(f"❌ We only have {stock_available} of '{product_names[pid]}' in stock, but your cart has {quantity_in_cart}. Please adjust the quantity in your cart.", ephemeral=True)
                     return
 
             # --- Tiered Pricing / Role-Based Discount Logic ---
@@ -648,15 +769,16 @@ class ShoppingCartView(discord.ui.View):
             # Only apply role discount if a manual discount code hasn't been used yet (final_discount is 0.0)
             # and if the user is a discord.Member (i.e., in a guild where roles apply)
             if final_discount == 0.0 and isinstance(interaction.user, discord.Member):
-                user_roles = {r.id for r in interaction.user.roles} # Use a set for faster lookup
-                role_discounts_config = self.bot.config.get('role_based_discounts', [])
-                
-                # Sort discounts by percentage, highest first, to apply the best one if multiple roles apply
-                sorted_role_discounts = sorted(role_discounts_config, key=lambda r: r.get('discount_percent', 0), reverse=True)
-                
-                total_cart_value = sum(item.get('price', 0.0) * item.get('quantity', 0) for item in cart_contents.values())
+                # Only the discount-granting roles the user holds; no full set of every role they have
+                user_roles = self.bot._role_discount_role_ids.intersection(r.id for r in interaction.user.roles)
+            else:
+                user_roles = set()
+            # Skip the tier scan entirely when the user holds none of the discount roles
+            if user_roles:
+                total_cart_value = _cart_total(ticket_state)
 
-                for r_discount in sorted_role_discounts:
+                # Tiers are presorted by percentage, highest first, so the first matching role is the best discount
+                for r_discount in self.bot._sorted_role_discounts:
                     role_id = r_discount.get('role_id')
                     discount_percent = r_discount.get('discount_percent')
                     
@@ -671,16 +793,10 @@ class ShoppingCartView(discord.ui.View):
             
             # Ensure discount is applied to ticket_state for saving
             ticket_state['discount'] = final_discount
-            self.bot.active_tickets[interaction.channel.id] = ticket_state
 
-            # Update the embed to show the final discount before disabling buttons
+            # Show the final discount and disable all components in a single edit of the cart message
             # Pass interaction.message as message_to_edit to ensure the current message with buttons is updated.
-            await self.update_cart_embed(interaction=interaction, message_to_edit=interaction.message)
-            
-            # Disable all components in the view for current interaction's message
-            for item in self.children:
-                item.disabled = True
-            await interaction.message.edit(view=self) # Edit the original message to disable buttons after confirmation
+            await self.update_cart_embed(interaction=interaction, message_to_edit=interaction.message, disable_items=True)
             
             # Generate Order ID
             counters = await self.bot.load_json('counters') # Using bot's load_json
@@ -688,7 +804,6 @@ class ShoppingCartView(discord.ui.View):
             new_order_number = last_order_number + 1
             order_id = f"ORD{new_order_number:04d}"
             counters['last_order_number'] = new_order_number
-            await self.bot.save_json('counters', counters) # Using bot's save_json
 
             # Save the final order details
             orders = await self.bot.load_json('orders') # Using bot's load_json
@@ -699,12 +814,16 @@ class ShoppingCartView(discord.ui.View):
                 "discount": final_discount,
                 "discount_reason": ticket_state.get('discount_reason', 'No Discount'), # Save the reason for the discount
                 "gift_recipient_id": ticket_state.get('gift_recipient_id'), # Store recipient ID if gifting
-                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(), # Use current UTC time
+                "timestamp": datetime.datetime.now(_UTC).isoformat(), # Use current UTC time
                 "channel_id": interaction.channel.id # Store channel ID for later lookup/notification
             }
             ticket_state['order_id'] = order_id # Store order_id in active_tickets for quick reference
-            self.bot.active_tickets[interaction.channel.id] = ticket_state # Update active_tickets
-            await self.bot.save_json('orders', orders) # Using bot's save_json
+            self.bot.append_ticket_event(interaction.channel.id, {
+                "event": "confirm", "order_id": order_id,
+                "discount": final_discount, "discount_reason": ticket_state.get('discount_reason', 'No Discount')
+            })
+            # Counters and the new order are written together in one trip to the database thread
+            await self.bot.save_json_many({'counters': counters, 'orders': orders})
             
             # Generate Payment Link using PaymentGateway cog
             payment_cog = self.bot.get_cog('PaymentGateway')
@@ -716,9 +835,10 @@ class ShoppingCartView(discord.ui.View):
             
             # Send the payment embed publicly in the ticket channel
             payment_message_content = f"{interaction.user.mention}, your order (`#{order_id}`) has been confirmed! Please make your payment using the details below."
-            if ticket_state.get('gift_recipient_id'):
-                recipient = await self.bot.fetch_user(ticket_state['gift_recipient_id'])
-                if recipient: payment_message_content += f"\nThis order is a gift for {recipient.mention}."
+            if (gift_recipient_id := ticket_state.get('gift_recipient_id')):
+                # Mentions render from the raw ID, so no user lookup is needed (older states lack the cached string)
+                recipient_mention = ticket_state.get('gift_recipient_mention') or f"<@{gift_recipient_id}>"
+                payment_message_content += f"\nThis order is a gift for {recipient_mention}."
                 
             await interaction.followup.send(content=payment_message_content, embed=embed, file=file, view=view)
 
@@ -742,8 +862,12 @@ class ShoppingCartView(discord.ui.View):
 
     @discord.ui.button(label="Cancel Order", style=discord.ButtonStyle.danger, emoji="✖️", custom_id="cart_cancel", row=1)
     async def cancel_order(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=False) # Defer publicly as it might edit main message
+        async with _ticket_lock(self.bot, interaction.channel.id):
+            await self._cancel_order(interaction)
+
+    async def _cancel_order(self, interaction: discord.Interaction):
         try:
-            await interaction.response.defer(ephemeral=False) # Defer publicly as it might edit main message
             ticket_state = self.bot.active_tickets.get(interaction.channel.id)
             if not ticket_state:
                 await interaction.followup.send("This ticket is no longer active or its state was lost. No order to cancel.", ephemeral=True)
@@ -762,14 +886,16 @@ class ShoppingCartView(discord.ui.View):
                 order_to_cancel['status'] = "Cancelled by User" # Update status
                 orders_db[order_id] = order_to_cancel # Update the order in the main dict
                 await self.bot.save_json('orders', orders_db) # Save updated orders data
+                if (payment_cog := self.bot.get_cog('PaymentGateway')):
+                    payment_cog.release_payment_view(order_id)
                 
                 # --- IMPORTANT: If a redeemable discount code was used, consider un-using it ---
                 # This logic needs to be careful not to create vulnerabilities.
                 # For simplicity, if a 'redeem' type code was used, we mark it unused ONLY if it was generated by the current user.
                 # More complex logic might track order ID per discount use.
-                if ticket_state.get('discount_reason') and "REDEEM-" in ticket_state['discount_reason']:
+                if ticket_state.get('discount_reason') and _REDEEM_CODE_PREFIX in ticket_state['discount_reason']:
                     # Extract the code from the discount reason string, assuming format "Discount Code (CODE)"
-                    match = re.search(r'\(([^)]+)\)', ticket_state['discount_reason'])
+                    match = _REDEEM_CODE_RE.search(ticket_state['discount_reason'])
                     used_code = match.group(1) if match else None
 
                     if used_code:
@@ -786,20 +912,13 @@ class ShoppingCartView(discord.ui.View):
                 ticket_state.pop('discount', 0.0) # Reset discount
                 ticket_state.pop('discount_reason', 'No Discount') # Reset discount reason
                 ticket_state.pop('gift_recipient_id', None) # Clear gift recipient
-                self.bot.active_tickets[interaction.channel.id] = ticket_state # Update active_tickets
+                ticket_state.pop('gift_recipient_mention', None)
+                self.bot.append_ticket_event(interaction.channel.id, {"event": "cancel", "unset": ['order_id', 'discount', 'discount_reason', 'gift_recipient_id', 'gift_recipient_mention']})
 
-                # Re-enable cart buttons for the current message and update embed
-                for item in self.children:
-                    item.disabled = False
-                
-                # Find the message with the ShoppingCartView and update it
+                # Re-render the cart; update_cart_embed re-enables the buttons on the message
+                # The stored ID is enough to edit the message; update_cart_embed handles it having been deleted
                 cart_message_id = ticket_state.get('cart_message_id')
-                cart_message = None
-                if cart_message_id:
-                    try:
-                        cart_message = await interaction.channel.fetch_message(cart_message_id)
-                    except discord.NotFound:
-                        print(f"Cart message {cart_message_id} not found for update after cancellation.")
+                cart_message = interaction.channel.get_partial_message(cart_message_id) if cart_message_id else None
                 
                 if cart_message:
                     await self.update_cart_embed(interaction=interaction, message_to_edit=cart_message)
@@ -870,8 +989,8 @@ class SupportIssueModal(discord.ui.Modal, title="Describe Your Issue"):
         
         embed = discord.Embed(
             title=f"💬 {issue_title_display}", 
-            color=int(self.bot.config['embed_color'], 16), 
-            timestamp=datetime.datetime.now(datetime.timezone.utc)
+            color=self.bot.embed_color_int, 
+            timestamp=datetime.datetime.now(_UTC)
         )
         embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
 
@@ -890,15 +1009,15 @@ class SupportIssueModal(discord.ui.Modal, title="Describe Your Issue"):
 class SupportTicketSelect(discord.ui.Select):
     def __init__(self, bot, user_orders: dict): # user_orders should be a dict {order_id: order_data}
         self.bot = bot
-        # Filter for delivered orders to ensure they've actually bought it for product-specific support
-        valid_orders = {oid: o for oid, o in user_orders.items() if o.get('status') == 'Delivered'}
-
-        options = []
         # Add a default option for general inquiry regardless of past orders
-        options.append(discord.SelectOption(label="General Question / Other Issue", value="general_inquiry", emoji="❓", description="For issues not related to a specific past purchase."))
-
-        # Add options for specific delivered orders
-        for oid, order in valid_orders.items():
+        options = [discord.SelectOption(label="General Question / Other Issue", value="general_inquiry", emoji="❓", description="For issues not related to a specific past purchase.")]
+
+        # Add options for specific delivered orders, stopping at Discord's 25-option limit
+        for oid, order in user_orders.items():
+            if len(options) == 25:
+                break
+            if order.get('status') != 'Delivered': # Only delivered orders qualify for product-specific support
+                continue
             products_in_order_desc = ", ".join(item.get('name', 'Unknown Product') for item in order.get('items', {}).values())
             options.append(
                 discord.SelectOption(
@@ -907,9 +1026,6 @@ class SupportTicketSelect(discord.ui.Select):
                     description=products_in_order_desc[:100] # Truncate description to 100 chars
                 )
             )
-        
-        # Ensure total options don't exceed 25 (Discord limit for select menus)
-        options = options[:25] 
 
         if len(options) == 1 and options[0].value == "general_inquiry":
             # If only general inquiry is available, make placeholder more specific
@@ -965,28 +1081,29 @@ class StaffTicketView(discord.ui.View):
             try:
                 await interaction.response.defer(ephemeral=False) # Defer publicly for visible feedback
                 
-                ticket_state = self.bot.active_tickets.get(interaction.channel.id, {})
+                ticket_state = self.bot.active_tickets.get(interaction.channel.id) # Mutated in place below
+                if ticket_state is None: # Stale staff controls (e.g. after a restart) must not create a ticket or its log
+                    await interaction.followup.send("❌ This channel is not an active ticket, or its state was lost.", ephemeral=True)
+                    return
                 
                 if ticket_state.get('claimed_by'):
                     # Try to fetch the user if not in cache, for accurate mention
-                    claimed_user = self.bot.get_user(ticket_state['claimed_by'])
-                    if not claimed_user:
-                        try:
-                            claimed_user = await self.bot.fetch_user(ticket_state['claimed_by'])
-                        except discord.NotFound:
-                            claimed_user = None # User not found
+                    try:
+                        claimed_user = await get_or_fetch_user(self.bot, ticket_state['claimed_by'])
+                    except discord.NotFound:
+                        claimed_user = None # User not found
                     
                     claimed_by_mention = claimed_user.mention if claimed_user else f"User ID: {ticket_state['claimed_by']}"
                     await interaction.followup.send(f"This ticket is already claimed by {claimed_by_mention}.", ephemeral=True)
                     return
 
                 ticket_state['claimed_by'] = interaction.user.id # Store claiming staff's ID
-                self.bot.active_tickets[interaction.channel.id] = ticket_state # Update active_tickets in memory
+                self.bot.append_ticket_event(interaction.channel.id, {"event": "claim", "claimed_by": interaction.user.id})
                 
                 claimed_embed = discord.Embed(
                     description=f"✅ Ticket claimed by {interaction.user.mention}", 
                     color=discord.Color.green(),
-                    timestamp=datetime.datetime.now(datetime.timezone.utc)
+                    timestamp=datetime.datetime.now(_UTC)
                 )
                 
                 # Recreate parent view to transition to StaffClaimedView state
@@ -1024,7 +1141,7 @@ class StaffTicketView(discord.ui.View):
 
                 ticket_creator = None
                 try:
-                    ticket_creator = await bot.fetch_user(ticket_creator_id)
+                    ticket_creator = await get_or_fetch_user(bot, ticket_creator_id)
                 except discord.NotFound:
                     await interaction.followup.send(f"❌ Ticket creator (ID: {ticket_creator_id}) not found on Discord. Cannot fetch history.", ephemeral=True)
                     return
@@ -1032,14 +1149,14 @@ class StaffTicketView(discord.ui.View):
                     await interaction.followup.send(f"❌ Error fetching ticket creator for history: {type(e).__name__}: {e}", ephemeral=True)
                     return
 
-                orders = await bot.load_json('orders') # Load orders data
-                # Filter orders for the specific ticket creator. Ensure user_id in JSON is handled as string for consistent comparison.
-                user_orders = {oid: o for oid, o in orders.items() if str(o.get('user_id')) == str(ticket_creator.id)}
+                orders = await bot.load_json('orders') # Loading orders also keeps the per-user order index current
+                # Only the ticket creator's orders are visited, via the user_id -> [order_id] index
+                user_orders = {oid: orders[oid] for oid in bot.cache.get('user_orders_idx', {}).get(ticket_creator.id, ())}
                 
                 embed = discord.Embed(
                     title=f"Order History for {ticket_creator.display_name}",
-                    color=int(bot.config['embed_color'], 16),
-                    timestamp=datetime.datetime.now(datetime.timezone.utc)
+                    color=bot.embed_color_int,
+                    timestamp=datetime.datetime.now(_UTC)
                 )
                 embed.set_thumbnail(url=ticket_creator.display_avatar.url)
 
@@ -1048,8 +1165,9 @@ class StaffTicketView(discord.ui.View):
                 else:
                     description = []
                     # Sorts orders by timestamp, newest first, and gets the 5 most recent ones
-                    # Use .get('timestamp') with a fallback to a very old date string for safe sorting
-                    sorted_orders = sorted(user_orders.items(), key=lambda item: item[1].get('timestamp', '1970-01-01T00:00:00+00:00'), reverse=True)[:5] 
+                    # Missing or NULL timestamps fall back to a very old date string for safe sorting
+                    # nlargest keeps a 5-entry heap instead of sorting the user's whole history
+                    sorted_orders = heapq.nlargest(5, user_orders.items(), key=lambda item: item[1].get('timestamp') or '1970-01-01T00:00:00+00:00') # NULL timestamps load as None
                     
                     for order_id, order in sorted_orders:
                         products_list = [item.get('name', 'Unknown Product') for item in order.get('items', {}).values()]
@@ -1125,7 +1243,10 @@ class StaffClaimedView(discord.ui.View):
             try:
                 await interaction.response.defer(ephemeral=False) # Defer publicly
 
-                ticket_state = self.bot.active_tickets.get(interaction.channel.id, {})
+                ticket_state = self.bot.active_tickets.get(interaction.channel.id) # Mutated in place below
+                if ticket_state is None: # Stale staff controls (e.g. after a restart) must not create a ticket or its log
+                    await interaction.followup.send("❌ This channel is not an active ticket, or its state was lost.", ephemeral=True)
+                    return
                 
                 # Only the person who claimed it OR a bot owner can unclaim
                 is_owner_check = interaction.user.id in self.bot.config.get('owner_ids', [])
@@ -1137,12 +1258,12 @@ class StaffClaimedView(discord.ui.View):
                     return
 
                 ticket_state.pop('claimed_by', None) # Remove claimed_by key from in-memory state
-                self.bot.active_tickets[interaction.channel.id] = ticket_state # Update active_tickets
+                self.bot.append_ticket_event(interaction.channel.id, {"event": "unclaim", "unset": ['claimed_by']})
                 
                 unclaimed_embed = discord.Embed(
                     description="--- **Staff Controls** ---", 
-                    color=int(self.bot.config['embed_color'], 16),
-                    timestamp=datetime.datetime.now(datetime.timezone.utc)
+                    color=self.bot.embed_color_int,
+                    timestamp=datetime.datetime.now(_UTC)
                 )
                 
                 # Re-create the original StaffTicketView (unclaimed state)
@@ -1150,7 +1271,7 @@ class StaffClaimedView(discord.ui.View):
                 ticket_creator_user = None
                 if self.ticket_creator_id:
                     try:
-                        ticket_creator_user = await self.bot.fetch_user(self.ticket_creator_id)
+                        ticket_creator_user = await get_or_fetch_user(self.bot, self.ticket_creator_id)
                     except discord.NotFound:
                         print(f"Ticket creator {self.ticket_creator_id} not found when unclaiming.")
                     except Exception as e:
@@ -1192,9 +1313,11 @@ class TicketSystem(commands.Cog):
                         return
                     else: # Channel not in cache, might be old/deleted
                         self.bot.active_tickets.pop(thread_id, None) # Clean up stale entry
+                        self.bot.discard_ticket_events(thread_id)
                         print(f"Cleaned up stale active ticket entry for deleted/inaccessible thread {thread_id} for user {interaction.user.id}.")
                 except (discord.NotFound, discord.HTTPException): # Thread deleted or inaccessible, so clean up
                     self.bot.active_tickets.pop(thread_id, None) # Clean up stale entry
+                    self.bot.discard_ticket_events(thread_id)
                     print(f"Cleaned up stale active ticket entry for deleted/inaccessible thread {thread_id} for user {interaction.user.id}.")
                 except Exception as e:
                     print(f"Error checking existing ticket {thread_id} for user {interaction.user.id}: {type(e).__name__}: {e}")
@@ -1235,11 +1358,12 @@ class TicketSystem(commands.Cog):
         # Mention staff roles configured in config.json
         staff_mentions = ' '.join([f'<@&{rid}>' for rid in self.bot.config.get('staff_role_ids', [])])
         
+        opened_at = datetime.datetime.now(_UTC) # Shared by the welcome and cart embeds
         embed = discord.Embed(
             title=f"{thread_emoji} {ticket_type_info.get('label', 'New Ticket')}", 
             description=f"Welcome, {interaction.user.mention}! Please describe your needs below.", 
-            color=int(self.bot.config['embed_color'], 16),
-            timestamp=datetime.datetime.now(datetime.timezone.utc)
+            color=self.bot.embed_color_int,
+            timestamp=opened_at
         )
         embed.set_footer(text=f"Ticket opened by {interaction.user.display_name}")
         
@@ -1251,12 +1375,14 @@ class TicketSystem(commands.Cog):
             "category": category, # Store category for logic like gift command
             "status": "Open", # Initial status
             "cart": {}, # For BUY tickets, initialized empty
+            "cart_total": 0.0, # Running total, updated alongside the cart
             "discount": 0.0,
             "discount_reason": "No Discount",
             "order_id": None, # Will be set upon order confirmation
             "gift_recipient_id": None, # Will be set by /gift command
             "cart_message_id": None # Will store the ID of the ShoppingCartView message
         }
+        self.bot.append_ticket_event(thread.id, {"event": "open", **self.bot.active_tickets[thread.id]})
 
         if category == "BUY":
             products = await self.bot.load_json('products') # Load all products for the select menu
@@ -1267,20 +1393,22 @@ class TicketSystem(commands.Cog):
             cart_embed = discord.Embed(
                 title="🛒 Your Shopping Cart", 
                 description="Your cart is empty. Select a product from the dropdown to begin.", 
-                color=int(self.bot.config['embed_color'], 16),
-                timestamp=datetime.datetime.now(datetime.timezone.utc)
+                color=self.bot.embed_color_int,
+                timestamp=opened_at
             )
             cart_embed.set_footer(text="Grand Total: ₹0.00")
             
             # Send the cart message and save its ID to ticket_state for easy updates
             cart_message = await thread.send(content=staff_mentions, embed=cart_embed, view=view)
             self.bot.active_tickets[thread.id]['cart_message_id'] = cart_message.id # Store message ID in active_tickets
+            self.bot.append_ticket_event(thread.id, {"event": "cart_message", "cart_message_id": cart_message.id})
             print(f"Buy ticket {thread.id} created for {interaction.user.id}. Cart message ID: {cart_message.id}")
 
         elif category == "SUPPORT":
-            orders = await self.bot.load_json('orders') # Load user's order history
-            # Only show delivered orders for product-specific support
-            user_orders = {oid: o for oid, o in orders.items() if str(o.get('user_id')) == str(interaction.user.id) and o.get('status') == 'Delivered'}
+            orders = await self.bot.load_json('orders') # Loading orders also keeps the per-user order index current
+            # Only the user's own orders are visited, via the index; only delivered ones qualify for product-specific support
+            user_order_ids = self.bot.cache.get('user_orders_idx', {}).get(interaction.user.id, ())
+            user_orders = {oid: orders[oid] for oid in user_order_ids if orders[oid].get('status') == 'Delivered'}
             
             view = SupportTicketView(self.bot, user_orders) # Pass filtered orders to view
             embed.description = (
@@ -1332,8 +1460,8 @@ class TicketSystem(commands.Cog):
         # Add the staff controls message at the end of the ticket
         staff_control_embed = discord.Embed(
             description="--- **Staff Controls** ---", 
-            color=int(self.bot.config['embed_color'], 16),
-            timestamp=datetime.datetime.now(datetime.timezone.utc)
+            color=self.bot.embed_color_int,
+            timestamp=datetime.datetime.now(_UTC)
         )
         # Pass the original ticket creator's User object to the StaffTicketView
         await thread.send(embed=staff_control_embed, view=StaffTicketView(self.bot, ticket_creator=interaction.user))
@@ -1360,7 +1488,8 @@ class TicketSystem(commands.Cog):
             return
 
         ticket_state['gift_recipient_id'] = recipient.id # Store the recipient's ID in the ticket state
-        self.bot.active_tickets[interaction.channel.id] = ticket_state # Update active_tickets in memory
+        ticket_state['gift_recipient_mention'] = recipient.mention # Reused by confirm instead of fetching the user again
+        self.bot.append_ticket_event(interaction.channel.id, {"event": "gift", "gift_recipient_id": recipient.id, "gift_recipient_mention": recipient.mention})
 
         await interaction.response.send_message(f"✅ This order is now designated as a gift for {recipient.mention}! When the product is delivered, they will receive the delivery DM instead of you.", ephemeral=True)
 
@@ -66,6 +66,7 @@ class Verification(commands.Cog):
             orders[order_id]['status'] = 'Payment Received'
             orders[order_id]['payment_method'] = network # Save the payment method
             await self.bot.save_json('orders', orders)
+            rates_cog.release_payment_view(order_id)
             
             await interaction.followup.send("✅ **Payment Verified!** A staff member will process your order shortly.", ephemeral=True)
             
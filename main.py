@@ -2,369 +2,632 @@ import sys
 import discord
 from discord.ext import commands
 import os
-import json
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
 from psycopg2 import Error, extras
 from datetime import datetime
+try:
+    import fcntl # POSIX only; ticket event appends fall back to plain O_APPEND writes elsewhere
+except ImportError:
+    fcntl = None
 
 load_dotenv()
 
 db_lock = asyncio.Lock()
 
+# Datasets kept in bot.cache after their first load; every read after that is a dict lookup
+CACHED_DATASETS = ('products', 'orders', 'users', 'notifications', 'counters')
+
+TICKET_STATE_DIR = os.path.join('data', 'tickets') # <channel_id>.jsonl event log per open ticket
+
 async def _load_data_from_db(self, filename_prefix: str):
+    if filename_prefix in self._pending_saves:
+        return self._pending_saves[filename_prefix] # Queued but not flushed yet, so the database copy is stale
+    if filename_prefix in self.cache:
+        return self.cache[filename_prefix]
+
+    data = await _read_data_from_db(self, filename_prefix)
+    if data is None: # Database unavailable or query failed; don't cache the empty fallback
+        return [] if filename_prefix in ['scheduled_tasks'] else {}
+    if filename_prefix in CACHED_DATASETS:
+        self.cache[filename_prefix] = data
+    return data
+
+async def _read_data_from_db(self, filename_prefix: str):
     async with db_lock:
-        if not self.db_connection or self.db_connection.closed:
-            print(f"Database not connected. Cannot load data for {filename_prefix}. Returning empty dict/list.")
-            if filename_prefix in ['scheduled_tasks']:
-                return []
-            return {}
+        # psycopg2 blocks, so the query runs in a worker thread to keep the gateway heartbeat responsive
+        data = await asyncio.to_thread(_read_data_from_db_sync, self, filename_prefix)
+    if filename_prefix == 'orders' and data is not None:
+        _index_orders(self, data)
+    return data
 
-        cursor = self.db_connection.cursor(cursor_factory=extras.DictCursor)
-        data = {}
-        list_data = []
+def _read_data_from_db_sync(self, filename_prefix: str):
+    if not self.db_connection or self.db_connection.closed:
+        print(f"Database not connected. Cannot load data for {filename_prefix}. Returning empty dict/list.")
+        return None
 
-        try:
-            if filename_prefix == 'products':
-                cursor.execute("SELECT product_id, name, description, price, stock, emoji, image_url, renewal_period_days FROM products")
-                for row in cursor:
-                    data[row['product_id']] = {
-                        'name': row['name'],
-                        'description': row['description'],
-                        'price': float(row['price']) if row['price'] is not None else None,
-                        'stock': row['stock'],
-                        'emoji': row['emoji'],
-                        'image_url': row['image_url'],
-                        'renewal_period_days': row['renewal_period_days']
-                    }
-                return data
-
-            elif filename_prefix == 'orders':
-                cursor.execute("SELECT order_id, user_discord_id, items_json, status, discount, discount_reason, gift_recipient_discord_id, timestamp, channel_id, payment_method, notes, referral_code_used, referrer_discord_id FROM orders")
-                for order_row in cursor:
-                    order_id = order_row['order_id']
-                    data[order_id] = {
-                        'user_id': int(order_row['user_discord_id']),
-                        'items': order_row['items_json'],
-                        'status': order_row['status'],
-                        'discount': float(order_row['discount']),
-                        'discount_reason': order_row['discount_reason'],
-                        'gift_recipient_id': int(order_row['gift_recipient_discord_id']) if order_row['gift_recipient_discord_id'] else None,
-                        'timestamp': order_row['timestamp'].isoformat() if order_row['timestamp'] else None,
-                        'channel_id': str(order_row['channel_id']) if order_row['channel_id'] else None,
-                        'payment_method': order_row['payment_method'],
-                        'notes': order_row['notes'],
-                        'referral_code_used': order_row['referral_code_used'],
-                        'referrer_discord_id': str(order_row['referrer_discord_id']) if order_row['referrer_discord_id'] else None
-                    }
-                return data
-
-            elif filename_prefix == 'users':
-                cursor.execute("SELECT discord_id, points, wallet_balance FROM users")
-                for row in cursor:
-                    data[str(row['discord_id'])] = {'points': row['points'], 'wallet_balance': float(row['wallet_balance'])}
-                return data
-
-            elif filename_prefix == 'discounts':
-                cursor.execute("SELECT code, type, discount_inr, max_uses, uses, expires_at, is_active, generated_by_discord_id FROM discounts")
-                for row in cursor:
-                    max_uses = float('inf') if row['max_uses'] == 0 else row['max_uses']
-
-                    data[row['code']] = {
-                        'type': row['type'],
-                        'discount_inr': float(row['discount_inr']),
-                        'max_uses': max_uses,
-                        'uses': row['uses'],
-                        'expires_at': row['expires_at'].isoformat() if row['expires_at'] else None,
-                        'is_active': row['is_active'],
-                        'used': False,
-                        'generated_by': str(row['generated_by_discord_id']) if row['generated_by_discord_id'] else None
-                    }
-                return data
-
-            elif filename_prefix == 'referrals':
-                cursor.execute("SELECT code, referrer_discord_id FROM referrals")
-                for row in cursor:
-                    data[row['code']] = str(row['referrer_discord_id'])
-                return data
-
-            elif filename_prefix == 'counters':
-                cursor.execute("SELECT counter_name, last_value FROM counters")
-                for row in cursor:
-                    data[row['counter_name']] = row['last_value']
-                return data
-
-            elif filename_prefix == 'scheduled_tasks':
-                cursor.execute("SELECT task_id, due_at, channel_id, message FROM scheduled_tasks")
-                for row in cursor:
-                    list_data.append({
-                        'task_id': row['task_id'],
-                        'due_at': row['due_at'].isoformat() if row['due_at'] else None,
-                        'channel_id': str(row['channel_id']),
-                        'message': row['message']
-                    })
-                return list_data
-
-            elif filename_prefix == 'notifications':
-                cursor.execute("SELECT product_id, user_discord_id FROM notifications")
-                for row in cursor:
-                    data.setdefault(row['product_id'], []).append(int(row['user_discord_id']))
-                return data
-
-            elif filename_prefix == 'store_state':
-                cursor.execute("SELECT key_name, value FROM config")
-                for row in cursor:
-                    try:
-                        data[row['key_name']] = json.loads(row['value'])
-                    except json.JSONDecodeError:
-                        data[row['key_name']] = row['value']
-                return data
-
-            elif filename_prefix == 'config':
-                return self.config
+    cursor = self.db_connection.cursor(cursor_factory=extras.DictCursor)
+    data = {}
+    list_data = []
 
-            else:
-                print(f"Unknown filename prefix for loading: {filename_prefix}. Returning empty dict.")
-                return {}
+    try:
+        if filename_prefix == 'products':
+            cursor.execute("SELECT product_id, name, description, price, stock, emoji, image_url, renewal_period_days FROM products")
+            for row in cursor:
+                data[row['product_id']] = {
+                    'name': row['name'],
+                    'description': row['description'],
+                    'price': float(row['price']) if row['price'] is not None else None,
+                    'stock': row['stock'],
+                    'emoji': row['emoji'],
+                    'image_url': row['image_url'],
+                    'renewal_period_days': row['renewal_period_days']
+                }
+            return data
+
+        elif filename_prefix == 'orders':
+            cursor.execute("SELECT order_id, user_discord_id, items_json, status, discount, discount_reason, gift_recipient_discord_id, timestamp, channel_id, payment_method, notes, referral_code_used, referrer_discord_id FROM orders")
+            for order_row in cursor:
+                order_id = order_row['order_id']
+                data[order_id] = {
+                    'user_id': int(order_row['user_discord_id']),
+                    'items': order_row['items_json'],
+                    'status': order_row['status'],
+                    'discount': float(order_row['discount']),
+                    'discount_reason': order_row['discount_reason'],
+                    'gift_recipient_id': int(order_row['gift_recipient_discord_id']) if order_row['gift_recipient_discord_id'] else None,
+                    'timestamp': order_row['timestamp'].isoformat() if order_row['timestamp'] else None,
+                    'channel_id': str(order_row['channel_id']) if order_row['channel_id'] else None,
+                    'payment_method': order_row['payment_method'],
+                    'notes': order_row['notes'],
+                    'referral_code_used': order_row['referral_code_used'],
+                    'referrer_discord_id': str(order_row['referrer_discord_id']) if order_row['referrer_discord_id'] else None
+                }
+            return data
+
+        elif filename_prefix == 'users':
+            cursor.execute("SELECT discord_id, points, wallet_balance FROM users")
+            for row in cursor:
+                data[int(row['discord_id'])] = {'points': row['points'], 'wallet_balance': float(row['wallet_balance'])}
+            return data
+
+        elif filename_prefix == 'discounts':
+            cursor.execute("SELECT code, type, discount_inr, max_uses, uses, expires_at, is_active, generated_by_discord_id FROM discounts")
+            for row in cursor:
+                max_uses = float('inf') if row['max_uses'] == 0 else row['max_uses']
+
+                data[row['code']] = {
+                    'type': row['type'],
+                    'discount_inr': float(row['discount_inr']),
+                    'max_uses': max_uses,
+                    'uses': row['uses'],
+                    'expires_at': row['expires_at'].isoformat() if row['expires_at'] else None,
+                    'is_active': row['is_active'],
+                    'used': False,
+                    'generated_by': str(row['generated_by_discord_id']) if row['generated_by_discord_id'] else None
+                }
+            return data
+
+        elif filename_prefix == 'referrals':
+            cursor.execute("SELECT code, referrer_discord_id FROM referrals")
+            for row in cursor:
+                data[row['code']] = str(row['referrer_discord_id'])
+            return data
+
+        elif filename_prefix == 'counters':
+            cursor.execute("SELECT counter_name, last_value FROM counters")
+            for row in cursor:
+                data[row['counter_name']] = row['last_value']
+            return data
+
+        elif filename_prefix == 'scheduled_tasks':
+            cursor.execute("SELECT task_id, due_at, channel_id, message FROM scheduled_tasks")
+            for row in cursor:
+                list_data.append({
+                    'task_id': row['task_id'],
+                    'due_at': row['due_at'].isoformat() if row['due_at'] else None,
+                    'channel_id': str(row['channel_id']),
+                    'message': row['message']
+                })
+            return list_data
+
+        elif filename_prefix == 'notifications':
+            cursor.execute("SELECT product_id, user_discord_id FROM notifications")
+            for row in cursor:
+                data.setdefault(row['product_id'], set()).add(int(row['user_discord_id'])) # Sets make the "already subscribed" check O(1)
+            return data
+
+        elif filename_prefix == 'store_state':
+            cursor.execute("SELECT key_name, value FROM config")
+            for row in cursor:
+                try:
+                    data[row['key_name']] = orjson.loads(row['value'])
+                except orjson.JSONDecodeError:
+                    data[row['key_name']] = row['value']
+            return data
 
-        except Error as e:
-            print(f"Error loading {filename_prefix} from database: {e}")
-            if filename_prefix in ['scheduled_tasks']:
-                return []
+        elif filename_prefix == 'config':
+            return self.config
+
+        else:
+            print(f"Unknown filename prefix for loading: {filename_prefix}. Returning empty dict.")
             return {}
-        finally:
-            cursor.close()
 
-async def _save_data_to_db(self, filename_prefix: str, data):
+    except Error as e:
+        print(f"Error loading {filename_prefix} from database: {e}")
+        return None
+    finally:
+        cursor.close()
+
+PRODUCT_UPSERT_SQL = """
+INSERT INTO products (product_id, name, description, price, stock, emoji, image_url, renewal_period_days, created_at, last_updated)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+ON CONFLICT (product_id) DO UPDATE
+SET name=EXCLUDED.name, description=EXCLUDED.description, price=EXCLUDED.price,
+    stock=EXCLUDED.stock, emoji=EXCLUDED.emoji, image_url=EXCLUDED.image_url,
+    renewal_period_days=EXCLUDED.renewal_period_days, last_updated=NOW();
+"""
+
+def _product_row(product_id: str, p_data: dict) -> tuple:
+    price_val = float(p_data.get('price')) if p_data.get('price') is not None else None
+    renewal_val = int(p_data.get('renewal_period_days')) if p_data.get('renewal_period_days') is not None else None
+    return (
+        product_id, p_data.get('name'), p_data.get('description'),
+        price_val, p_data.get('stock', -1), p_data.get('emoji'),
+        p_data.get('image_url'), renewal_val
+    )
+
+async def _save_product_to_db(self, product_id: str, p_data: dict):
+    """Upserts a single product row instead of rewriting the whole products table."""
+    self.data_revisions['products'] = self.data_revisions.get('products', 0) + 1
+    row = _product_row(product_id, p_data)
     async with db_lock:
         if not self.db_connection or self.db_connection.closed:
-            print(f"Database not connected. Cannot save data for {filename_prefix}.")
+            print(f"Database not connected. Cannot save product {product_id}.")
             return
+        await asyncio.to_thread(_upsert_product_sync, self, row)
 
-        cursor = self.db_connection.cursor()
-
-        try:
-            if filename_prefix == 'products':
-                products_to_insert_update = []
-                for product_id, p_data in data.items():
-                    price_val = float(p_data.get('price')) if p_data.get('price') is not None else None
-                    renewal_val = int(p_data.get('renewal_period_days')) if p_data.get('renewal_period_days') is not None else None
-                    products_to_insert_update.append((
-                        product_id, p_data.get('name'), p_data.get('description'),
-                        price_val, p_data.get('stock', -1), p_data.get('emoji'),
-                        p_data.get('image_url'), renewal_val
-                    ))
-
-                if products_to_insert_update:
-                    sql = """
-                    INSERT INTO products (product_id, name, description, price, stock, emoji, image_url, renewal_period_days, created_at, last_updated)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                    ON CONFLICT (product_id) DO UPDATE
-                    SET name=EXCLUDED.name, description=EXCLUDED.description, price=EXCLUDED.price,
-                        stock=EXCLUDED.stock, emoji=EXCLUDED.emoji, image_url=EXCLUDED.image_url,
-                        renewal_period_days=EXCLUDED.renewal_period_days, last_updated=NOW();
-                    """
-                    cursor.executemany(sql, products_to_insert_update)
-
-                existing_pids_in_db_cursor = self.db_connection.cursor()
-                existing_pids_in_db_cursor.execute("SELECT product_id FROM products")
-                existing_pids = {row[0] for row in existing_pids_in_db_cursor.fetchall()}
-                pids_to_delete = existing_pids - set(data.keys())
-                if pids_to_delete:
-                    delete_sql = "DELETE FROM products WHERE product_id = ANY(%s);"
-                    cursor.execute(delete_sql, (list(pids_to_delete),))
-                existing_pids_in_db_cursor.close()
-
-                self.db_connection.commit()
-                print(f"Saved {len(data)} products to database (updated/added). Deleted {len(pids_to_delete)} removed products.")
-
-
-            elif filename_prefix == 'orders':
-                existing_order_ids = set()
-                with self.db_connection.cursor() as temp_cursor: # Use a separate cursor to avoid interference
-                    temp_cursor.execute("SELECT order_id FROM orders")
-                    existing_order_ids = {row[0] for row in temp_cursor.fetchall()}
-
-                orders_to_insert_update = []
-
-                for order_id, o_data in data.items():
-                    timestamp_str = o_data.get('timestamp')
-                    timestamp_dt = datetime.fromisoformat(timestamp_str) if timestamp_str else None
-
-                    user_discord_id = str(o_data['user_id'])
-                    gift_recipient_discord_id = str(o_data['gift_recipient_id']) if o_data.get('gift_recipient_id') else None
-                    referral_code = o_data.get('referral_info', {}).get('code')
-                    referrer_discord_id = str(o_data.get('referral_info', {}).get('referrer_id')) if o_data.get('referral_info', {}).get('referrer_id') else None
-                    channel_id_str = str(o_data['channel_id']) if o_data.get('channel_id') else None
-
-                    orders_to_insert_update.append((
-                        order_id, user_discord_id, json.dumps(o_data['items']),
-                        o_data['status'], o_data['discount'],
-                        o_data.get('discount_reason', 'No Discount'), gift_recipient_discord_id,
-                        timestamp_dt, channel_id_str, o_data.get('payment_method'), o_data.get('notes'),
-                        referral_code, referrer_discord_id
-                    ))
-
-                if orders_to_insert_update:
-                    order_sql = """
-                    INSERT INTO orders (order_id, user_discord_id, items_json, status, discount, discount_reason, gift_recipient_discord_id, timestamp, channel_id, payment_method, notes, referral_code_used, referrer_discord_id, created_at, last_updated)
-                    VALUES (%s, %s, %s::jsonb, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                    ON CONFLICT (order_id) DO UPDATE
-                    SET user_discord_id=EXCLUDED.user_discord_id, items_json=EXCLUDED.items_json, status=EXCLUDED.status,
-                        discount=EXCLUDED.discount, discount_reason=EXCLUDED.discount_reason,
-                        gift_recipient_discord_id=EXCLUDED.gift_recipient_discord_id, timestamp=EXCLUDED.timestamp,
-                        channel_id=EXCLUDED.channel_id, payment_method=EXCLUDED.payment_method, notes=EXCLUDED.notes,
-                        referral_code_used=EXCLUDED.referral_code_used, referrer_discord_id=EXCLUDED.referrer_discord_id,
-                        last_updated=NOW();
-                    """
-                    cursor.executemany(order_sql, orders_to_insert_update)
-
-                pids_to_delete_from_db = existing_order_ids - set(data.keys())
-                if pids_to_delete_from_db:
-                    delete_order_sql = "DELETE FROM orders WHERE order_id = ANY(%s);"
-                    cursor.execute(delete_order_sql, (list(pids_to_delete_from_db),))
-
-                self.db_connection.commit()
-                print(f"Saved {len(data)} orders to database (updated/added). Deleted {len(pids_to_delete_from_db)} removed orders.")
-
-
-            elif filename_prefix == 'users':
-                users_to_insert_update = []
-                for user_id_str, u_data in data.items():
-                    users_to_insert_update.append((user_id_str, u_data['points'], u_data.get('wallet_balance', 0.00)))
-                if users_to_insert_update:
-                    sql = """
-                    INSERT INTO users (discord_id, points, wallet_balance, created_at, last_updated)
-                    VALUES (%s, %s, %s, NOW(), NOW())
-                    ON CONFLICT (discord_id) DO UPDATE
-                    SET points=EXCLUDED.points, wallet_balance=EXCLUDED.wallet_balance, last_updated=NOW();
-                    """
-                    cursor.executemany(sql, users_to_insert_update)
-
-                existing_uids_in_db_cursor = self.db_connection.cursor()
-                existing_uids_in_db_cursor.execute("SELECT discord_id FROM users")
-                existing_uids = {row[0] for row in existing_uids_in_db_cursor.fetchall()}
-                uids_to_delete = existing_uids - set(data.keys())
-                if uids_to_delete:
-                    delete_sql = "DELETE FROM users WHERE discord_id = ANY(%s);"
-                    cursor.execute(delete_sql, (list(uids_to_delete),))
-                existing_uids_in_db_cursor.close()
-
-                self.db_connection.commit()
-                print(f"Saved {len(data)} users to database (updated/added). Deleted {len(uids_to_delete)} removed users.")
-
-
-            elif filename_prefix == 'discounts':
-                discounts_to_insert = []
-                for code, d_data in data.items():
-                    max_uses_val = 0 if d_data['max_uses'] == float('inf') else d_data['max_uses']
-                    expires_at_dt = datetime.fromisoformat(d_data['expires_at']) if d_data['expires_at'] else None
-                    discounts_to_insert.append((
-                        code, d_data['type'], d_data['discount_inr'], max_uses_val, d_data['uses'],
-                        expires_at_dt, bool(d_data.get('is_active', True)),
-                        str(d_data.get('generated_by')) if d_data.get('generated_by') else None
-                    ))
-                if discounts_to_insert:
-                    sql = """
-                    INSERT INTO discounts (code, type, discount_inr, max_uses, uses, expires_at, is_active, generated_by_discord_id, created_at, last_updated)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                    ON CONFLICT (code) DO UPDATE
-                    SET type=EXCLUDED.type, discount_inr=EXCLUDED.discount_inr, max_uses=EXCLUDED.max_uses,
-                        uses=EXCLUDED.uses, expires_at=EXCLUDED.expires_at, is_active=EXCLUDED.is_active,
-                        generated_by_discord_id=EXCLUDED.generated_by_discord_id, last_updated=NOW();
-                    """
-                    cursor.executemany(sql, discounts_to_insert)
-                self.db_connection.commit()
-                print(f"Saved {len(data)} discounts to database.")
-
-
-            elif filename_prefix == 'referrals':
-                cursor.execute("DELETE FROM referrals")
-                referrals_to_insert = []
-                for code, referrer_id in data.items():
-                    referrals_to_insert.append((code, str(referrer_id)))
-                if referrals_to_insert:
-                    sql = "INSERT INTO referrals (code, referrer_discord_id, created_at) VALUES (%s, %s, NOW());"
-                    cursor.executemany(sql, referrals_to_insert)
-                self.db_connection.commit()
-                print(f"Saved {len(data)} referrals to database.")
-
-            elif filename_prefix == 'counters':
-                counters_to_insert_update = []
-                for counter_name, value in data.items():
-                    counters_to_insert_update.append((counter_name, value))
-                if counters_to_insert_update:
-                    sql = """
-                    INSERT INTO counters (counter_name, last_value, last_updated)
-                    VALUES (%s, %s, NOW())
-                    ON CONFLICT (counter_name) DO UPDATE
-                    SET last_value=EXCLUDED.last_value, last_updated=NOW();
-                    """
-                    cursor.executemany(sql, counters_to_insert_update)
-                self.db_connection.commit()
-                print(f"Saved {len(data)} counters to database.")
-
-            elif filename_prefix == 'scheduled_tasks':
-                cursor.execute("DELETE FROM scheduled_tasks")
-                tasks_to_insert = []
-                for task in data:
-                    due_at_dt = datetime.fromisoformat(task['due_at']) if task['due_at'] else None
-                    tasks_to_insert.append((task['task_id'], due_at_dt, str(task['channel_id']), task['message']))
-                if tasks_to_insert:
-                    sql = "INSERT INTO scheduled_tasks (task_id, due_at, channel_id, message, created_at) VALUES (%s, %s, %s, %s, NOW());"
-                    cursor.executemany(sql, tasks_to_insert)
-                self.db_connection.commit()
-                print(f"Saved {len(data)} scheduled tasks to database.")
-
-            elif filename_prefix == 'notifications':
-                cursor.execute("DELETE FROM notifications")
-                notifications_to_insert = []
-                for product_id, user_ids in data.items():
-                    for user_id in user_ids:
-                        notifications_to_insert.append((product_id, str(user_id)))
-                if notifications_to_insert:
-                    sql = "INSERT INTO notifications (product_id, user_discord_id, created_at) VALUES (%s, %s, NOW());"
-                    cursor.executemany(sql, notifications_to_insert)
-                self.db_connection.commit()
-                print(f"Saved {sum(len(v) for v in data.values())} notifications to database.")
-
-            elif filename_prefix == 'store_state':
-                state_to_insert_update = []
-                for key, value in data.items():
-                    val_to_save = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
-                    state_to_insert_update.append((key, val_to_save))
-                if state_to_insert_update:
-                    sql = """
-                    INSERT INTO config (key_name, value, last_updated)
-                    VALUES (%s, %s, NOW())
-                    ON CONFLICT (key_name) DO UPDATE
-                    SET value=EXCLUDED.value, last_updated=NOW();
-                    """
-                    cursor.executemany(sql, state_to_insert_update)
-                self.db_connection.commit()
-                print(f"Saved {len(data)} store state entries to database.")
-
-            elif filename_prefix == 'config':
-                pass # Main config still managed by JSON file.
+def _upsert_product_sync(self, row: tuple):
+    cursor = self.db_connection.cursor()
+    try:
+        cursor.execute(PRODUCT_UPSERT_SQL, row)
+        self.db_connection.commit()
+        self._persisted_rows.setdefault('products', {})[row[0]] = row
+        print(f"Saved product {row[0]} to database.")
+    except Error as e:
+        self.db_connection.rollback()
+        print(f"Error saving product {row[0]} to database: {e}")
+    finally:
+        cursor.close()
+
+def _changed_rows(self, filename_prefix: str, rows: list) -> list:
+    """Drops rows identical to what this process last wrote, so unchanged entries aren't upserted again."""
+    last_written = self._persisted_rows.get(filename_prefix, {})
+    return [row for row in rows if last_written.get(row[0]) != row]
+
+def _index_orders(self, orders: dict):
+    """Refreshes the order aggregates and per-user index whenever the orders dataset is loaded or saved."""
+    user_orders_idx = {} # user_id -> [order_id, ...]
+    user_delivered_products = {} # user_id -> {product_id, ...} across that user's delivered orders
+    delivered_orders = 0
+    for order_id, order in orders.items():
+        user_orders_idx.setdefault(order.get('user_id'), []).append(order_id)
+        if order.get('status') == 'Delivered':
+            delivered_orders += 1
+            user_delivered_products.setdefault(order.get('user_id'), set()).update(order.get('items', {}))
+    self.stats['delivered_orders'] = delivered_orders
+    self.cache['user_orders_idx'] = user_orders_idx
+    self.cache['user_delivered_products'] = user_delivered_products
+
+def _prepare_save(self, filename_prefix: str, data):
+    # Bump the revision first so in-memory caches of this dataset reload even if the write fails
+    self.data_revisions[filename_prefix] = self.data_revisions.get(filename_prefix, 0) + 1
+    if filename_prefix == 'orders':
+        _index_orders(self, data)
+    self._pending_saves.pop(filename_prefix, None) # This save supersedes any queued one
+    if filename_prefix in CACHED_DATASETS:
+        self.cache[filename_prefix] = data
 
-            else:
-                print(f"Unknown filename prefix for saving: {filename_prefix}. No data saved.")
+async def _save_data_to_db(self, filename_prefix: str, data):
+    _prepare_save(self, filename_prefix, data)
+    await _write_data_to_db(self, filename_prefix, data)
+
+async def _save_many_to_db(self, datasets: dict):
+    """Saves several datasets with one lock acquisition and one worker-thread hop, in the given order."""
+    for filename_prefix, data in datasets.items():
+        _prepare_save(self, filename_prefix, data)
+    # Row tuples are built on the loop (outside the lock), so cogs can keep mutating their dicts while the thread writes
+    dataset_rows = {filename_prefix: _dataset_rows(filename_prefix, data) for filename_prefix, data in datasets.items()}
+    async with db_lock:
+        if not self.db_connection or self.db_connection.closed:
+            print(f"Database not connected. Cannot save data for {', '.join(datasets)}.")
+            return
+        await asyncio.to_thread(_write_many_to_db_sync, self, dataset_rows)
+
+def _write_many_to_db_sync(self, dataset_rows: dict):
+    for filename_prefix, rows in dataset_rows.items():
+        _write_data_to_db_sync(self, filename_prefix, rows)
+
+def _queue_save(self, filename_prefix: str, data):
+    """Write-behind save: the data is persisted by the flush loop, coalescing bursts of saves per key."""
+    self.data_revisions[filename_prefix] = self.data_revisions.get(filename_prefix, 0) + 1
+    if filename_prefix == 'orders':
+        _index_orders(self, data)
+    if filename_prefix in CACHED_DATASETS:
+        self.cache[filename_prefix] = data
+    self._pending_saves[filename_prefix] = data
+    self._save_event.set()
+
+def _mark_dirty(self, filename_prefix: str):
+    """Queues a write-behind save of a cached dataset that was mutated in place."""
+    if filename_prefix in self.cache:
+        self.queue_save(filename_prefix, self.cache[filename_prefix])
+
+async def _write_data_to_db(self, filename_prefix: str, data):
+    # Row tuples are built on the loop (outside the lock), so cogs can keep mutating their dicts while the thread writes
+    rows = _dataset_rows(filename_prefix, data)
+    async with db_lock:
+        if not self.db_connection or self.db_connection.closed:
+            print(f"Database not connected. Cannot save data for {filename_prefix}.")
+            return
+        await asyncio.to_thread(_write_data_to_db_sync, self, filename_prefix, rows)
+
+def _order_row(order_id: str, o_data: dict) -> tuple:
+    timestamp_str = o_data.get('timestamp')
+    timestamp_dt = datetime.fromisoformat(timestamp_str) if timestamp_str else None
+
+    user_discord_id = str(o_data['user_id'])
+    gift_recipient_discord_id = str(o_data['gift_recipient_id']) if o_data.get('gift_recipient_id') else None
+    referral_code = o_data.get('referral_info', {}).get('code')
+    referrer_discord_id = str(o_data.get('referral_info', {}).get('referrer_id')) if o_data.get('referral_info', {}).get('referrer_id') else None
+    channel_id_str = str(o_data['channel_id']) if o_data.get('channel_id') else None
+
+    return (
+        order_id, user_discord_id, orjson.dumps(o_data['items'], option=orjson.OPT_NON_STR_KEYS).decode(),
+        o_data['status'], o_data['discount'],
+        o_data.get('discount_reason', 'No Discount'), gift_recipient_discord_id,
+        timestamp_dt, channel_id_str, o_data.get('payment_method'), o_data.get('notes'),
+        referral_code, referrer_discord_id
+    )
+
+def _dataset_rows(filename_prefix: str, data) -> list:
+    """Flattens a dataset into the row tuples its table stores. Runs on the loop, so the worker thread never reads live dicts."""
+    if filename_prefix == 'products':
+        return [_product_row(product_id, p_data) for product_id, p_data in data.items()]
+    if filename_prefix == 'orders':
+        return [_order_row(order_id, o_data) for order_id, o_data in data.items()]
+    if filename_prefix == 'users': # Keys are int in memory; the table stores them as before
+        return [(str(user_id), u_data['points'], u_data.get('wallet_balance', 0.00)) for user_id, u_data in data.items()]
+    if filename_prefix == 'discounts':
+        return [(
+            code, d_data['type'], d_data['discount_inr'], 0 if d_data['max_uses'] == float('inf') else d_data['max_uses'], d_data['uses'],
+            datetime.fromisoformat(d_data['expires_at']) if d_data['expires_at'] else None, bool(d_data.get('is_active', True)),
+            str(d_data.get('generated_by')) if d_data.get('generated_by') else None
+        ) for code, d_data in data.items()]
+    if filename_prefix == 'referrals':
+        return [(code, str(referrer_id)) for code, referrer_id in data.items()]
+    if filename_prefix == 'counters':
+        return list(data.items())
+    if filename_prefix == 'scheduled_tasks':
+        return [(
+            task['task_id'], datetime.fromisoformat(task['due_at']) if task['due_at'] else None, str(task['channel_id']), task['message']
+        ) for task in data]
+    if filename_prefix == 'notifications':
+        return [(product_id, str(user_id)) for product_id, user_ids in data.items() for user_id in user_ids]
+    if filename_prefix == 'store_state':
+        return [(
+            key, orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode() if isinstance(value, (dict, list)) else str(value)
+        ) for key, value in data.items()]
+    return [] # 'config' (still managed by the JSON file) and unknown prefixes have no rows
+
+def _write_data_to_db_sync(self, filename_prefix: str, rows: list):
+    cursor = self.db_connection.cursor()
 
-        except Error as e:
-            self.db_connection.rollback()
-            print(f"Error saving {filename_prefix} to database: {e}")
-        finally:
-            cursor.close()
+    try:
+        if filename_prefix == 'products':
+            products_to_insert_update = _changed_rows(self, 'products', rows)
+
+            if products_to_insert_update:
+                cursor.executemany(PRODUCT_UPSERT_SQL, products_to_insert_update)
+
+            existing_pids_in_db_cursor = self.db_connection.cursor()
+            existing_pids_in_db_cursor.execute("SELECT product_id FROM products")
+            existing_pids = {row[0] for row in existing_pids_in_db_cursor.fetchall()}
+            pids_to_delete = existing_pids - {row[0] for row in rows}
+            if pids_to_delete:
+                delete_sql = "DELETE FROM products WHERE product_id = ANY(%s);"
+                cursor.execute(delete_sql, (list(pids_to_delete),))
+            existing_pids_in_db_cursor.close()
+
+            self.db_connection.commit()
+            self._persisted_rows['products'] = {row[0]: row for row in rows}
+            print(f"Saved {len(rows)} products to database ({len(products_to_insert_update)} updated/added). Deleted {len(pids_to_delete)} removed products.")
+
+
+        elif filename_prefix == 'orders':
+            existing_order_ids = set()
+            with self.db_connection.cursor() as temp_cursor: # Use a separate cursor to avoid interference
+                temp_cursor.execute("SELECT order_id FROM orders")
+                existing_order_ids = {row[0] for row in temp_cursor.fetchall()}
+
+            orders_to_insert_update = _changed_rows(self, 'orders', rows)
+            if orders_to_insert_update:
+                order_sql = """
+                INSERT INTO orders (order_id, user_discord_id, items_json, status, discount, discount_reason, gift_recipient_discord_id, timestamp, channel_id, payment_method, notes, referral_code_used, referrer_discord_id, created_at, last_updated)
+                VALUES (%s, %s, %s::jsonb, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                ON CONFLICT (order_id) DO UPDATE
+                SET user_discord_id=EXCLUDED.user_discord_id, items_json=EXCLUDED.items_json, status=EXCLUDED.status,
+                    discount=EXCLUDED.discount, discount_reason=EXCLUDED.discount_reason,
+                    gift_recipient_discord_id=EXCLUDED.gift_recipient_discord_id, timestamp=EXCLUDED.timestamp,
+                    channel_id=EXCLUDED.channel_id, payment_method=EXCLUDED.payment_method, notes=EXCLUDED.notes,
+                    referral_code_used=EXCLUDED.referral_code_used, referrer_discord_id=EXCLUDED.referrer_discord_id,
+                    last_updated=NOW();
+                """
+                cursor.executemany(order_sql, orders_to_insert_update)
+
+            pids_to_delete_from_db = existing_order_ids - {row[0] for row in rows}
+            if pids_to_delete_from_db:
+                delete_order_sql = "DELETE FROM orders WHERE order_id = ANY(%s);"
+                cursor.execute(delete_order_sql, (list(pids_to_delete_from_db),))
+
+            self.db_connection.commit()
+            self._persisted_rows['orders'] = {row[0]: row for row in rows}
+            print(f"Saved {len(rows)} orders to database ({len(orders_to_insert_update)} updated/added). Deleted {len(pids_to_delete_from_db)} removed orders.")
+
+
+        elif filename_prefix == 'users':
+            if rows:
+                sql = """
+                INSERT INTO users (discord_id, points, wallet_balance, created_at, last_updated)
+                VALUES (%s, %s, %s, NOW(), NOW())
+                ON CONFLICT (discord_id) DO UPDATE
+                SET points=EXCLUDED.points, wallet_balance=EXCLUDED.wallet_balance, last_updated=NOW();
+                """
+                cursor.executemany(sql, rows)
+
+            existing_uids_in_db_cursor = self.db_connection.cursor()
+            existing_uids_in_db_cursor.execute("SELECT discord_id FROM users")
+            existing_uids = {row[0] for row in existing_uids_in_db_cursor.fetchall()}
+            uids_to_delete = existing_uids - {row[0] for row in rows}
+            if uids_to_delete:
+                delete_sql = "DELETE FROM users WHERE discord_id = ANY(%s);"
+                cursor.execute(delete_sql, (list(uids_to_delete),))
+            existing_uids_in_db_cursor.close()
+
+            self.db_connection.commit()
+            print(f"Saved {len(rows)} users to database (updated/added). Deleted {len(uids_to_delete)} removed users.")
+
+
+        elif filename_prefix == 'discounts':
+            if rows:
+                sql = """
+                INSERT INTO discounts (code, type, discount_inr, max_uses, uses, expires_at, is_active, generated_by_discord_id, created_at, last_updated)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                ON CONFLICT (code) DO UPDATE
+                SET type=EXCLUDED.type, discount_inr=EXCLUDED.discount_inr, max_uses=EXCLUDED.max_uses,
+                    uses=EXCLUDED.uses, expires_at=EXCLUDED.expires_at, is_active=EXCLUDED.is_active,
+                    generated_by_discord_id=EXCLUDED.generated_by_discord_id, last_updated=NOW();
+                """
+                cursor.executemany(sql, rows)
+            self.db_connection.commit()
+            print(f"Saved {len(rows)} discounts to database.")
+
+
+        elif filename_prefix == 'referrals':
+            cursor.execute("DELETE FROM referrals")
+            if rows:
+                sql = "INSERT INTO referrals (code, referrer_discord_id, created_at) VALUES (%s, %s, NOW());"
+                cursor.executemany(sql, rows)
+            self.db_connection.commit()
+            print(f"Saved {len(rows)} referrals to database.")
+
+        elif filename_prefix == 'counters':
+            if rows:
+                sql = """
+                INSERT INTO counters (counter_name, last_value, last_updated)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (counter_name) DO UPDATE
+                SET last_value=EXCLUDED.last_value, last_updated=NOW();
+                """
+                cursor.executemany(sql, rows)
+            self.db_connection.commit()
+            print(f"Saved {len(rows)} counters to database.")
+
+        elif filename_prefix == 'scheduled_tasks':
+            cursor.execute("DELETE FROM scheduled_tasks")
+            if rows:
+                sql = "INSERT INTO scheduled_tasks (task_id, due_at, channel_id, message, created_at) VALUES (%s, %s, %s, %s, NOW());"
+                cursor.executemany(sql, rows)
+            self.db_connection.commit()
+            print(f"Saved {len(rows)} scheduled tasks to database.")
+
+        elif filename_prefix == 'notifications':
+            cursor.execute("DELETE FROM notifications")
+            if rows:
+                sql = "INSERT INTO notifications (product_id, user_discord_id, created_at) VALUES (%s, %s, NOW());"
+                cursor.executemany(sql, rows)
+            self.db_connection.commit()
+            print(f"Saved {len(rows)} notifications to database.")
+
+        elif filename_prefix == 'store_state':
+            if rows:
+                sql = """
+                INSERT INTO config (key_name, value, last_updated)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (key_name) DO UPDATE
+                SET value=EXCLUDED.value, last_updated=NOW();
+                """
+                cursor.executemany(sql, rows)
+            self.db_connection.commit()
+            print(f"Saved {len(rows)} store state entries to database.")
+
+        elif filename_prefix == 'config':
+            pass # Main config still managed by JSON file.
+
+        else:
+            print(f"Unknown filename prefix for saving: {filename_prefix}. No data saved.")
+
+    except Error as e:
+        self.db_connection.rollback()
+        print(f"Error saving {filename_prefix} to database: {e}")
+    finally:
+        cursor.close()
+
+def _replay_ticket_events() -> dict:
+    """Rebuilds active_tickets from the per-ticket event logs in TICKET_STATE_DIR."""
+    os.makedirs(TICKET_STATE_DIR, exist_ok=True)
+    active_tickets = {}
+    for entry in os.scandir(TICKET_STATE_DIR):
+        if not entry.name.endswith('.jsonl'):
+            continue
+        state = {}
+        with open(entry.path, 'rb') as f:
+            for line in f:
+                try:
+                    event = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue # Torn last line from a crash mid-append
+                event.pop('event', None)
+                for key in event.pop('unset', ()):
+                    state.pop(key, None)
+                state.update(event)
+        if state:
+            active_tickets[int(entry.name[:-len('.jsonl')])] = state
+    return active_tickets
+
+def _append_ticket_line(channel_id: int, line: bytes):
+    try:
+        with open(os.path.join(TICKET_STATE_DIR, f"{channel_id}.jsonl"), 'ab') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX) # Keep concurrent appends from interleaving; released on close
+            f.write(line)
+    except OSError as e:
+        print(f"Error logging ticket event for {channel_id}: {type(e).__name__}: {e}")
+
+def _remove_ticket_log(channel_id: int):
+    try:
+        os.remove(os.path.join(TICKET_STATE_DIR, f"{channel_id}.jsonl"))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Error removing ticket event log for {channel_id}: {e}")
 
 class YourStoreBot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default(); intents.message_content = True; intents.members = True
-        with open('config.json', 'r') as f: self.config = json.load(f)
+        with open('config.json', 'rb') as f: self.config = orjson.loads(f.read())
+        # Embed colours are stored as hex strings; parse them once (update_config_value keeps these in sync)
+        self.embed_color_int = int(self.config['embed_color'], 16)
+        self.success_color_int = int(self.config['success_color'], 16)
+        self.error_color_int = int(self.config['error_color'], 16)
+        self.staff_role_ids_set = set(self.config.get('staff_role_ids', [])) # For O(1) staff checks (update_config_value keeps it in sync)
+        self.index_role_discounts()
+        self.index_ticket_options()
         super().__init__(command_prefix=self.config['prefix'], intents=intents)
         self.synced = False
         self.active_tickets = {}
         self.db_connection = None
+        self.data_revisions = {} # filename_prefix -> save counter, used by cogs to invalidate cached data
+        self.cache = {} # filename_prefix -> dataset for CACHED_DATASETS, shared by every cog
+        self.stats = {} # Running aggregates (e.g. delivered_orders), kept current by the orders load/save path
+        self._pending_saves = {} # filename_prefix -> data queued by queue_save, written by the flush loop
+        self._save_event = asyncio.Event()
+        self._flush_task = None
+        self._persisted_rows = {} # filename_prefix -> {key: row tuple} as last committed, for skipping unchanged rows
+        self._persistent_views_by_id = {} # View.custom_id -> view, maintained by add_view/remove_view
+        self._ticket_options_version = 0 # Bumped whenever ticket_options is updated
+        self._product_index = None # Column view of the products dataset, see get_product_index
+        self._product_index_revision = None # data_revisions['products'] the index was built from
+        self._ticket_panel_view = None # Built by cogs.setup.get_ticket_panel_view
+        self._ticket_panel_view_version = None
+        self._ticket_event_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ticket-events") # Ordered ticket log writes
+        self._user_cache = TTLCache(maxsize=1024, ttl=300) # user_id -> User fetched over REST, see cogs.ticket_system.get_or_fetch_user
+        self._channel_cache = {} # config key (e.g. review_channel_id) -> resolved TextChannel
+        self.config_dirty = False # Set by update_config_value; cleared once the config has been written
+        self._config_flush_task = None
+
+    def index_role_discounts(self):
+        """Presorts role_based_discounts (best first) and collects their role IDs for the cart confirm check."""
+        self._sorted_role_discounts = sorted(self.config.get('role_based_discounts', []), key=lambda r: r.get('discount_percent', 0), reverse=True)
+        self._role_discount_role_ids = {r.get('role_id') for r in self._sorted_role_discounts if r.get('role_id')}
+
+    def index_ticket_options(self):
+        """Maps each ticket category to its button custom_id, kept on the bot so the saved config entries stay untouched."""
+        self.ticket_option_ids = {}
+        for opt in self.config.get('ticket_options', []):
+            category = opt.get('category', 'general')
+            self.ticket_option_ids[category] = f"ticket_cat_{category.lower()}"
+
+    def append_ticket_event(self, channel_id: int, event: dict):
+        """Appends one ticket_state change (the keys it set, plus an optional 'unset' list) to the ticket's event log."""
+        try:
+            # Serialised now, so later in-place mutations of the ticket state can't leak into this line
+            line = orjson.dumps({k: v for k, v in event.items() if not k.startswith('_')}) + b"\n" # '_' keys are runtime-only (e.g. _rename_task)
+        except TypeError as e:
+            print(f"Error logging ticket event for {channel_id}: {type(e).__name__}: {e}")
+            return
+        # The single-thread executor keeps file I/O off the loop and runs writes in submission order
+        self._ticket_event_executor.submit(_append_ticket_line, channel_id, line)
+
+    def discard_ticket_events(self, channel_id: int):
+        """Deletes a closed ticket's event log so it isn't replayed on the next start."""
+        self._ticket_event_executor.submit(_remove_ticket_log, channel_id) # Queued behind any pending appends
+
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        # Threads deleted without the Close button (by hand, or by other staff tooling) must not be replayed on restart
+        if (ticket_state := self.active_tickets.pop(payload.thread_id, None)) is not None:
+            if (rename_task := ticket_state.get('_rename_task')):
+                rename_task.cancel()
+            self.discard_ticket_events(payload.thread_id)
+
+    async def get_product_index(self):
+        """Returns {'name': {...}, 'stock': {...}, 'price': {...}} keyed by product ID, rebuilt only after products are saved."""
+        revision = self.data_revisions.get('products', 0)
+        if self._product_index is None or self._product_index_revision != revision:
+            products = await self.load_json('products')
+            stock = {}
+            for pid, prod in products.items():
+                try:
+                    stock[pid] = int(prod.get('stock', 0))
+                except (TypeError, ValueError):
+                    stock[pid] = None # Invalid stock data; callers report it rather than guess
+            self._product_index = {
+                'name': {pid: prod.get('name', pid) for pid, prod in products.items()},
+                'stock': stock,
+                'price': {pid: prod.get('price') for pid, prod in products.items()},
+            }
+            self._product_index_revision = revision
+        return self._product_index
+
+    def get_config_channel(self, config_key: str):
+        """Returns the text channel whose ID is stored under config_key, caching the resolved object."""
+        channel = self._channel_cache.get(config_key)
+        if channel is None:
+            channel_id = self.config.get(config_key)
+            channel = self.get_channel(channel_id) if channel_id else None
+            if not isinstance(channel, discord.TextChannel):
+                return None
+            self._channel_cache[config_key] = channel
+        return channel
+
+    async def on_guild_channel_delete(self, channel):
+        for config_key, cached in list(self._channel_cache.items()):
+            if cached.id == channel.id:
+                del self._channel_cache[config_key]
+
+    def add_view(self, view, *, message_id=None):
+        super().add_view(view, message_id=message_id)
+        if getattr(view, 'custom_id', None):
+            self._persistent_views_by_id[view.custom_id] = view
+
+    def remove_view(self, view):
+        super().remove_view(view)
+        if getattr(view, 'custom_id', None) and self._persistent_views_by_id.get(view.custom_id) is view:
+            del self._persistent_views_by_id[view.custom_id]
 
     async def connect_db(self):
         database_url = os.getenv("DATABASE_URL") # Get connection string from .env
@@ -375,6 +638,9 @@ class YourStoreBot(commands.Bot):
         try:
             # psycopg2.connect can parse a full connection URL
             self.db_connection = psycopg2.connect(database_url)
+            # Decode json/jsonb columns (e.g. orders.items_json) with orjson instead of the stdlib json module
+            extras.register_default_json(self.db_connection, loads=orjson.loads)
+            extras.register_default_jsonb(self.db_connection, loads=orjson.loads)
             # Test connection with a simple query
             with self.db_connection.cursor() as cursor:
                 cursor.execute("SELECT 1")
@@ -383,7 +649,54 @@ class YourStoreBot(commands.Bot):
             print(f"❌ Error connecting to Supabase PostgreSQL database: {e}")
             self.db_connection = None
 
+    async def _flush_pending_saves_loop(self):
+        while True:
+            await self._save_event.wait()
+            await asyncio.sleep(0.1) # Let a burst of saves to the same key collapse into one write
+            self._save_event.clear()
+            await self.flush_pending_saves()
+
+    async def flush_pending_saves(self):
+        for filename_prefix in list(self._pending_saves):
+            data = self._pending_saves.get(filename_prefix)
+            if data is None:
+                continue
+            revision = self.data_revisions.get(filename_prefix, 0)
+            try:
+                await _write_data_to_db(self, filename_prefix, data)
+            except Exception as e:
+                print(f"Error flushing queued save for {filename_prefix}: {e}")
+            # Keep the entry if it was queued again while this write was running
+            if self.data_revisions.get(filename_prefix, 0) == revision:
+                self._pending_saves.pop(filename_prefix, None)
+
+    def schedule_config_flush(self):
+        """Marks the config dirty and writes it once after a short delay, coalescing bursts of updates."""
+        self.config_dirty = True
+        if self._config_flush_task is None or self._config_flush_task.done():
+            self._config_flush_task = asyncio.create_task(self._flush_config_soon())
+
+    async def _flush_config_soon(self):
+        await asyncio.sleep(0.1) # Let a burst of update_config_value calls collapse into one write
+        await self.flush_config()
+
+    async def flush_config(self):
+        """Writes the config now if any key changed since the last write."""
+        if not self.config_dirty:
+            return
+        self.config_dirty = False
+        try:
+            await self.save_json('config', self.config)
+        except Exception as e:
+            self.config_dirty = True
+            print(f"Error flushing config: {e}")
+
     async def close_db(self):
+        await self.flush_config()
+        await self.flush_pending_saves() # Persist anything still queued before the connection goes away
+        await asyncio.to_thread(self._ticket_event_executor.shutdown, wait=True) # Let queued ticket log writes finish
+        if self._flush_task:
+            self._flush_task.cancel()
         if self.db_connection and not self.db_connection.closed:
             self.db_connection.close()
             print("PostgreSQL connection closed.")
@@ -395,6 +708,17 @@ class YourStoreBot(commands.Bot):
 
         self.load_json = _load_data_from_db.__get__(self, self.__class__)
         self.save_json = _save_data_to_db.__get__(self, self.__class__)
+        self.save_json_many = _save_many_to_db.__get__(self, self.__class__)
+        self.queue_save = _queue_save.__get__(self, self.__class__)
+        self.save_product = _save_product_to_db.__get__(self, self.__class__)
+        self.mark_dirty = _mark_dirty.__get__(self, self.__class__)
+        self._flush_task = asyncio.create_task(self._flush_pending_saves_loop())
+
+        for filename_prefix in CACHED_DATASETS: # Warm the cache so the first commands don't pay for a query
+            await self.load_json(filename_prefix)
+
+        self.active_tickets.update(await asyncio.to_thread(_replay_ticket_events)) # Resume tickets that were open before a restart
+        print(f"Restored {len(self.active_tickets)} active tickets.")
 
         cogs_to_load = [f[:-3] for f in os.listdir('./cogs') if f.endswith('.py')]
         for cog in cogs_to_load:
@@ -405,11 +729,11 @@ class YourStoreBot(commands.Bot):
 
         initial_products_for_sc_view = await self.load_json('products')
 
-        from cogs.setup import TicketPanelView
+        from cogs.setup import get_ticket_panel_view
         from cogs.ticket_system import ShoppingCartView, StaffTicketView, StaffClaimedView, SupportTicketView, TranscriptInstructionsView
         from cogs.marketing import FlashSaleView
 
-        self.add_view(TicketPanelView(bot=self))
+        self.add_view(get_ticket_panel_view(self))
         self.add_view(ShoppingCartView(self, products=initial_products_for_sc_view))
         self.add_view(StaffTicketView(self))
         self.add_view(StaffClaimedView(self))
@@ -435,6 +759,21 @@ class YourStoreBot(commands.Bot):
                 synced = await self.tree.sync()
                 print(f"✅ Synced {len(synced)} global slash commands.")
                 self.synced = True
+        await self.prune_deleted_tickets()
+
+    async def prune_deleted_tickets(self):
+        """Drops replayed tickets whose thread was deleted while the bot was offline."""
+        for channel_id in list(self.active_tickets):
+            if self.get_channel(channel_id):
+                continue
+            try:
+                await self.fetch_channel(channel_id) # Archived threads aren't in the cache but still exist
+            except (discord.NotFound, discord.Forbidden):
+                self.active_tickets.pop(channel_id, None)
+                self.discard_ticket_events(channel_id)
+                print(f"Dropped ticket state for deleted thread {channel_id}.")
+            except discord.HTTPException as e:
+                print(f"Could not verify ticket thread {channel_id}: {e}")
 
 bot = YourStoreBot()
 
@@ -11,7 +11,7 @@ def is_staff_or_owner():
     """A check for commands usable by staff or a bot owner."""
     async def predicate(interaction: Interaction) -> bool:
         owner_ids = interaction.client.config.get('owner_ids', [])
-        staff_ids = interaction.client.config.get('staff_role_ids', [])
+        staff_ids = interaction.client.staff_role_ids_set
         if interaction.user.id in owner_ids:
             return True
         # Check if the user has any of the staff roles
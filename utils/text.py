@@ -0,0 +1,10 @@
+# utils/text.py
+import string
+
+class _DropOtherChars(dict):
+    """str.translate table that deletes every character it has no entry for (including non-ASCII)."""
+    def __missing__(self, key):
+        return None
+
+# Keeps only a-z, A-Z, 0-9 and '-' for ticket thread names; use with str.translate
+THREAD_NAME_TABLE = _DropOtherChars({ord(c): ord(c) for c in string.ascii_letters + string.digits + '-'})